@@ -0,0 +1,82 @@
+"""
+Scaling benchmark for SyncMerger.merge_nodes on synthetic trees
+
+Usage: python -m benchmarks.bench_merger [sizes...]
+"""
+import random
+import sys
+import time
+import uuid
+from typing import Tuple
+
+from notionsy.sync_merger import SyncMerger
+from notionsy.sync_tree import SyncTree, SyncNode, SyncNodeType, SyncMetadataLocal, SyncMetadataNotion
+
+HIERARCHY = ['course', 'lecture']
+DEFAULT_SIZES = [10_000, 100_000]
+COURSES = 10
+
+
+def build_trees(size: int, seed: int = 0) -> Tuple[SyncTree, SyncTree]:
+    """
+    Builds a local and notion tree with `size` nodes each. Nodes are matched by node id, local path,
+    notion id and fuzzy title in equal parts and a few nodes only exist on one side
+    :param size:
+    :param seed:
+    :return:
+    """
+    rng = random.Random(seed)
+    local, notion = SyncTree.create_local(), SyncTree.create_notion(str(uuid.uuid4()))
+    lectures = size // COURSES - 1
+
+    for c in range(COURSES):
+        lcourse = SyncNode(parent=local, node_type=SyncNodeType.GROUP, node_role='course',
+                           metadata_local=SyncMetadataLocal(f'Course {c}'))
+        ncourse = SyncNode(parent=notion, node_type=SyncNodeType.GROUP, node_role='course',
+                           metadata_notion=SyncMetadataNotion(str(uuid.uuid4()), f'Course {c}'))
+        ncourse.id = lcourse.id
+        local.children.append(lcourse)
+        notion.children.append(ncourse)
+
+        lnodes, nnodes = [], []
+        for i in range(lectures):
+            title = f'Lecture {c}-{i}'
+            ln = SyncNode(parent=lcourse, node_type=SyncNodeType.NOTE, node_role='lecture',
+                          metadata_local=SyncMetadataLocal(f'{title}.md'))
+            nn = SyncNode(parent=ncourse, node_type=SyncNodeType.NOTE, node_role='lecture',
+                          metadata_notion=SyncMetadataNotion(str(uuid.uuid4()), title))
+            kind = i % 5
+            if kind == 0:
+                nn.id = ln.id
+            elif kind == 1:
+                nn.metadata_local = SyncMetadataLocal(ln.metadata_local.path)
+            elif kind == 2:
+                ln.metadata_notion = SyncMetadataNotion(nn.metadata_notion.id, title)
+            elif kind == 3:
+                nn.metadata_notion.title = f'{title} (notion only)'
+            lnodes.append(ln)
+            nnodes.append(nn)
+
+        rng.shuffle(nnodes)
+        lcourse.children.extend(lnodes)
+        ncourse.children.extend(nnodes)
+
+    return local, notion
+
+
+def run(size: int) -> float:
+    local, notion = build_trees(size)
+    start = time.perf_counter()
+    SyncMerger().merge_nodes(HIERARCHY, local, notion)
+    return time.perf_counter() - start
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv] or DEFAULT_SIZES
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10_000))
+    for size in sizes:
+        print(f'merge_nodes {size:>8} nodes: {run(size):8.3f}s')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,304 @@
+"""
+End-to-end sync benchmark on a synthetic vault and an in-process fake Notion workspace shaped like the
+university template. Runs a dry run, an initial sync and an incremental sync and reports the time, peak memory
+and Notion api calls of every phase. Fails if a phase regressed against the stored baseline or the dry run changed
+the vault. The syncs go through the run_sync of the sync command, which reports its phases to be timed
+
+Usage: python -m benchmarks.bench_sync [sizes...] [--update-baseline] [--tolerance 0.5]
+
+The initial sync uploads half of the lectures through md2notion, so 100000 nodes take hours and are opt-in
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout, redirect_stderr
+from dataclasses import dataclass, field, asdict, replace
+from typing import Dict, List, Tuple
+
+from benchmarks.fake_notion import FakeNotion, FakeNotionClient, now_ms
+from notionsy import __main__ as cli
+from notionsy.sync_estimator import SyncEstimate
+from notionsy.templates import university
+from notionsy.utils.batcher import NotionBatcher
+from notionsy.utils.rate_limit import RateLimiter
+
+DEFAULT_SIZES = [1_000, 10_000]
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+LECTURES_PER_COURSE = 50
+CHANGED_FRACTION = 0.05
+DAY_MS = 24 * 60 * 60 * 1000
+# Rate limit of the dry run, high enough not to throttle the fake notion
+DRY_RUN_RATE_LIMIT = 1000.0
+# Options of the sync command. Conflicts keep the local edits rather than prompting
+SYNC_OPTIONS = cli.SyncOptions(conflict_policy='local')
+
+TITLE = 'title'
+UPDATED = 'UPDT'
+CREATED = 'CRTD'
+COURSE = 'TKKM'
+
+LECTURE_MARKDOWN = '''# {title}
+
+Notes of {title}.
+
+* First point
+* Second point
+
+Some closing remarks.
+'''
+
+
+@dataclass
+class PhaseResult:
+    seconds: float = 0
+    peak_mb: float = 0
+    calls: int = 0
+
+
+@dataclass
+class Workspace:
+    server: FakeNotion
+    root_dir: str
+    root_page: str
+    notion_lectures: List[str] = field(default_factory=lambda: [])
+    local_lectures: List[str] = field(default_factory=lambda: [])
+
+
+def build_workspace(size: int, root_dir: str, seed: int = 0) -> Workspace:
+    """
+    Builds a vault and a notion workspace with `size` nodes in total. Courses exist on both sides while half
+    of the lectures only exist locally and the other half only in notion
+    :param size:
+    :param root_dir:
+    :param seed:
+    :return:
+    """
+    rng = random.Random(seed)
+    server = FakeNotion()
+    created = now_ms() - 30 * DAY_MS
+    root = server.add_block('page', {'id': server.space_id}, 'space', properties={'title': [['University']]})
+    workspace = Workspace(server, root_dir, root['id'])
+
+    schema = {
+        TITLE: {'name': 'Name', 'type': 'title'},
+        UPDATED: {'name': 'Updated', 'type': 'last_edited_time'},
+        CREATED: {'name': 'Created', 'type': 'created_time'},
+    }
+    courses = server.add_collection(root, 'Uni Courses', schema)
+    lectures = server.add_collection(root, 'Lectures', {
+        **schema, COURSE: {'name': 'Course', 'type': 'relation', 'collection_id': courses['id']}
+    })
+
+    course_count = max(1, size // (LECTURES_PER_COURSE + 1))
+    lecture_count = size - course_count
+    course_rows = []
+    for c in range(course_count):
+        title = f'Course {c}'
+        course_rows.append(server.add_block(
+            'page', courses, 'collection', properties={TITLE: [[title]]}, last_edited_time=created
+        ))
+        os.makedirs(os.path.join(root_dir, title))
+
+    past = (created / 1000, created / 1000)
+    for i in range(lecture_count):
+        c = rng.randrange(course_count)
+        title = f'Lecture {c}-{i}'
+        if i % 2 == 0:
+            path = os.path.join(root_dir, f'Course {c}', f'{title}.md')
+            with open(path, 'w') as f:
+                f.write(LECTURE_MARKDOWN.format(title=title))
+            os.utime(path, past)
+            workspace.local_lectures.append(path)
+        else:
+            row = server.add_block('page', lectures, 'collection', last_edited_time=created, properties={
+                TITLE: [[title]], COURSE: [['‣', [['p', course_rows[c]['id']]]]]
+            })
+            server.add_block('header', row, properties={'title': [[title]]}, last_edited_time=created)
+            server.add_block('text', row, properties={'title': [[f'Notes of {title}.']]}, last_edited_time=created)
+            for point in ['First point', 'Second point']:
+                server.add_block('bulleted_list', row, properties={'title': [[point]]}, last_edited_time=created)
+            workspace.notion_lectures.append(row['id'])
+
+    return workspace
+
+
+def modify_workspace(workspace: Workspace, fraction: float, seed: int = 0):
+    """
+    Edits a fraction of the lectures which were created on either side during the initial sync
+    :param workspace:
+    :param fraction:
+    :param seed:
+    :return:
+    """
+    rng = random.Random(seed)
+    for path in rng.sample(workspace.local_lectures, int(len(workspace.local_lectures) * fraction)):
+        with open(path, 'a') as f:
+            f.write('\nAn edit made locally.\n')
+    for block_id in rng.sample(workspace.notion_lectures, int(len(workspace.notion_lectures) * fraction)):
+        workspace.server.touch(block_id)
+
+
+@contextmanager
+def measure(results: Dict[str, PhaseResult], name: str, client: FakeNotionClient):
+    calls = sum(client.calls.values())
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    results[name] = PhaseResult(
+        round(seconds, 3), round((peak - baseline) / 2 ** 20, 2), sum(client.calls.values()) - calls
+    )
+
+
+def snapshot_files(root_dir: str) -> Dict[str, Tuple[int, int]]:
+    files = {}
+    for path, _, names in os.walk(root_dir):
+        for name in names:
+            stat = os.stat(os.path.join(path, name))
+            files[os.path.relpath(os.path.join(path, name), root_dir)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def run_dry_run(workspace: Workspace, results: Dict[str, PhaseResult], prefix: str) -> SyncEstimate:
+    """
+    Runs a dry run the way the sync command does, with a rate limiter on the config, and checks it left the vault
+    untouched. The dry run has a client of its own, so it does not warm up the record store of the sync
+    :param workspace:
+    :param results:
+    :param prefix: prefix of the phase names
+    :return: the estimate of the plan
+    """
+    files = snapshot_files(workspace.root_dir)
+    client = FakeNotionClient(workspace.server)
+    rate_limiter = RateLimiter(DRY_RUN_RATE_LIMIT, int(DRY_RUN_RATE_LIMIT))
+    rate_limiter.install(client)
+    batcher = NotionBatcher()
+    batcher.install(client)
+    model = university.build_config(workspace.root_dir, workspace.root_page, client, rate_limiter)
+    data = model.data()
+    data.read()
+    with measure(results, f'{prefix}.dry_run', client):
+        estimate = cli.run_sync(client, model, data, batcher, replace(SYNC_OPTIONS, dry_run=True))
+    changed = set(files.items()) ^ set(snapshot_files(workspace.root_dir).items())
+    if changed:
+        raise AssertionError(f'Dry run changed the vault: {sorted({path for path, _ in changed})}')
+    return estimate
+
+
+def run_sync(
+        workspace: Workspace, client: FakeNotionClient, batcher: NotionBatcher, results: Dict[str, PhaseResult],
+        prefix: str
+):
+    """
+    Runs a sync through the run_sync of the sync command, timing each of its phases
+    :param workspace:
+    :param client:
+    :param batcher: batcher installed on the client
+    :param results:
+    :param prefix: prefix of the phase names
+    :return:
+    """
+    model = university.build_config(workspace.root_dir, workspace.root_page, client)
+    data = model.data()
+    data.read()
+    cli.run_sync(
+        client, model, data, batcher, SYNC_OPTIONS,
+        phase=lambda name: measure(results, f'{prefix}.{name}', client)
+    )
+
+
+def run(size: int) -> Tuple[Dict[str, PhaseResult], SyncEstimate]:
+    results: Dict[str, PhaseResult] = {}
+    with tempfile.TemporaryDirectory() as root_dir:
+        workspace = build_workspace(size, root_dir)
+        client = FakeNotionClient(workspace.server)
+        batcher = NotionBatcher()
+        batcher.install(client)
+        tracemalloc.start()
+        # Silence the progress output of the syncer and md2notion
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull), redirect_stderr(devnull):
+            try:
+                estimate = run_dry_run(workspace, results, 'initial')
+                run_sync(workspace, client, batcher, results, 'initial')
+                modify_workspace(workspace, CHANGED_FRACTION)
+                run_sync(workspace, client, batcher, results, 'incremental')
+            finally:
+                tracemalloc.stop()
+    return results, estimate
+
+
+def compare(size: int, results: Dict[str, PhaseResult], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    Compares the results with the baseline. Api calls are deterministic and may not increase at all, while time
+    and memory may exceed the baseline by the tolerance fraction
+    :param size:
+    :param results:
+    :param baseline:
+    :param tolerance:
+    :return: descriptions of the regressions
+    """
+    regressions = []
+    for phase, result in results.items():
+        expected = baseline.get(phase)
+        if expected is None:
+            continue
+        expected = PhaseResult(**expected)
+        if result.calls > expected.calls:
+            regressions.append(f'{size} {phase}: {result.calls} api calls, baseline {expected.calls}')
+        # Ignore noise of phases which take next to no time or memory
+        if result.seconds > max(expected.seconds * (1 + tolerance), expected.seconds + 0.05):
+            regressions.append(f'{size} {phase}: {result.seconds:.3f}s, baseline {expected.seconds:.3f}s')
+        if result.peak_mb > max(expected.peak_mb * (1 + tolerance), expected.peak_mb + 1):
+            regressions.append(f'{size} {phase}: {result.peak_mb:.2f}MB peak, baseline {expected.peak_mb:.2f}MB')
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='End-to-end sync benchmark against a fake Notion')
+    parser.add_argument('sizes', nargs='*', type=int, default=DEFAULT_SIZES)
+    parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed relative time and memory increase')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10_000))
+
+    baseline: Dict[str, Dict[str, dict]] = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    regressions: List[str] = []
+    for size in args.sizes:
+        results, estimate = run(size)
+        print(f'sync {size:>8} nodes')
+        for phase, result in results.items():
+            print(f'  {phase:<26} {result.seconds:9.3f}s {result.peak_mb:9.2f}MB {result.calls:8} calls')
+        print(f'  {"initial.sync estimate":<26} {estimate.api_calls:29} calls')
+
+        if args.update_baseline:
+            baseline[str(size)] = {phase: asdict(result) for phase, result in results.items()}
+        elif str(size) not in baseline:
+            print(f'  no baseline stored for {size} nodes')
+        else:
+            regressions += compare(size, results, baseline[str(size)], args.tolerance)
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'Baseline written to {BASELINE_PATH}')
+
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
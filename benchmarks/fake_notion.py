@@ -0,0 +1,216 @@
+"""
+In-process fake of the Notion api for benchmarks. FakeNotion keeps the records of a workspace and answers the
+endpoints notion-py uses; FakeNotionClient is a NotionClient routing all its requests to a FakeNotion instead
+of notion.so
+"""
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+from notion.client import NotionClient
+from notion.store import RecordStore
+
+from notionsy.utils.serialization import json_dumps, json_loads
+
+Record = Dict[str, Any]
+
+TABLES = ['block', 'collection', 'collection_view', 'notion_user', 'space']
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data: dict) -> None:
+        # Responses are serialized so the client never shares state with the fake server
+        self.content = json_dumps(data)
+
+    def json(self) -> dict:
+        return json_loads(self.content)
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeNotion:
+    """
+    Record store of a fake workspace answering loadUserContent, getRecordValues, loadPageChunk, queryCollection
+    and submitTransaction requests
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: Dict[str, Dict[str, Record]] = {table: {} for table in TABLES}
+        self.rows: Dict[str, List[str]] = defaultdict(list)
+        self.user_id = str(uuid.uuid4())
+        self.space_id = str(uuid.uuid4())
+        self.add('notion_user', {'id': self.user_id, 'email': 'bench@notionsy'})
+        self.add('space', {'id': self.space_id, 'name': 'Benchmark'})
+
+    def add(self, table: str, record: Record) -> Record:
+        record.setdefault('version', 1)
+        record.setdefault('alive', True)
+        self.records[table][record['id']] = record
+        self.index(table, record)
+        return record
+
+    def index(self, table: str, record: Record):
+        if table == 'block' and record.get('parent_table') == 'collection':
+            self.rows[record['parent_id']].append(record['id'])
+
+    def add_block(self, block_type: str, parent: Record, parent_table: str = 'block', **kwargs) -> Record:
+        timestamp = kwargs.pop('last_edited_time', None) or now_ms()
+        block = self.add('block', {
+            'id': str(uuid.uuid4()), 'type': block_type, 'parent_id': parent['id'], 'parent_table': parent_table,
+            'created_time': timestamp, 'last_edited_time': timestamp, 'created_by_id': self.user_id,
+            'created_by_table': 'notion_user', **kwargs
+        })
+        if parent_table == 'block':
+            parent.setdefault('content', []).append(block['id'])
+        return block
+
+    def add_collection(self, parent: Record, name: str, schema: Dict[str, dict]) -> Record:
+        """
+        Adds a collection view block with a single table view to the parent page
+        :param parent:
+        :param name:
+        :param schema:
+        :return: the collection record
+        """
+        block = self.add_block('collection_view', parent)
+        collection = self.add('collection', {
+            'id': str(uuid.uuid4()), 'name': [[name]], 'schema': schema, 'parent_id': block['id'],
+            'parent_table': 'block',
+        })
+        view = self.add('collection_view', {
+            'id': str(uuid.uuid4()), 'type': 'table', 'name': 'Default', 'parent_id': block['id'],
+            'parent_table': 'block',
+        })
+        block.update(collection_id=collection['id'], view_ids=[view['id']])
+        return collection
+
+    def touch(self, block_id: str):
+        block = self.records['block'][block_id]
+        block['last_edited_time'] = now_ms()
+        block['version'] += 1
+
+    def handle(self, endpoint: str, data: dict) -> dict:
+        method = getattr(self, f'handle_{endpoint}', None)
+        if method is None:
+            raise NotImplementedError(f'FakeNotion does not support: {endpoint}')
+        return method(data)
+
+    def recordmap(self, table: str, ids: List[str]) -> Dict[str, Dict[str, Record]]:
+        return {table: {id: {'role': 'editor', 'value': self.records[table][id]} for id in ids}}
+
+    def handle_loadUserContent(self, data: dict) -> dict:
+        return {'recordMap': {
+            **self.recordmap('notion_user', [self.user_id]),
+            **self.recordmap('space', [self.space_id]),
+        }}
+
+    def handle_getRecordValues(self, data: dict) -> dict:
+        results = []
+        for request in data['requests']:
+            record = self.records[request['table']].get(request['id'])
+            results.append({'role': 'editor', 'value': record} if record is not None else {})
+        return {'results': results}
+
+    def handle_loadPageChunk(self, data: dict) -> dict:
+        # The page and its content without descending into sub pages
+        blocks, stack = [], [data['pageId']]
+        while stack:
+            block = self.records['block'].get(stack.pop())
+            if block is None:
+                continue
+            blocks.append(block['id'])
+            if block['id'] == data['pageId'] or block['type'] != 'page':
+                stack.extend(reversed(block.get('content', [])))
+        return {'recordMap': self.recordmap('block', blocks)}
+
+    def handle_queryCollection(self, data: dict) -> dict:
+        since = query_since(data['query'].get('filter'))
+        rows = [
+            self.records['block'][id] for id in self.rows[data['collectionId']]
+            if self.records['block'][id].get('alive')
+        ]
+        if since is not None:
+            rows = [row for row in rows if row['last_edited_time'] >= since]
+        ids = [row['id'] for row in rows]
+        return {
+            'result': {'type': 'table', 'blockIds': ids, 'aggregationResults': [], 'total': len(ids)},
+            'recordMap': self.recordmap('block', ids),
+        }
+
+    def handle_submitTransaction(self, data: dict) -> dict:
+        for operation in data['operations']:
+            self.apply(**operation)
+        return {}
+
+    def apply(self, table: str, id: str, path: List[str], command: str, args: Any):
+        """
+        Applies a transaction operation the same way notion-py simulates it locally
+        """
+        created = id not in self.records[table]
+        record = self.records[table].setdefault(id, {})
+        if not path and command == 'set':
+            record.clear()
+            record.update(args)
+            if created:
+                self.index(table, record)
+            return
+
+        ref = record
+        path = list(path)
+        while len(path) > 1 or (path and command != 'set'):
+            ref = ref.setdefault(path.pop(0), [] if 'list' in command else {})
+
+        if command == 'update':
+            ref.update(args)
+        elif command == 'set':
+            ref[path[0]] = args
+        elif command == 'listAfter':
+            ref.insert(ref.index(args['after']) + 1, args['id']) if 'after' in args else ref.append(args['id'])
+        elif command == 'listBefore':
+            ref.insert(ref.index(args['before']), args['id']) if 'before' in args else ref.insert(0, args['id'])
+        elif command == 'listRemove' and args['id'] in ref:
+            ref.remove(args['id'])
+        record['version'] = record.get('version', 0) + 1
+
+
+def query_since(query_filter: Optional[dict]) -> Optional[int]:
+    """
+    Extracts the date of a date_is_on_or_after / date_is_after filter as utc timestamp in milliseconds
+    :param query_filter:
+    :return:
+    """
+    for item in (query_filter or {}).get('filters', []):
+        condition = item.get('filter', {})
+        if condition.get('operator') in ['date_is_on_or_after', 'date_is_after']:
+            start = datetime.strptime(condition['value']['value']['start_date'], '%Y-%m-%d')
+            return int((start - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return None
+
+
+class FakeNotionClient(NotionClient):
+    """
+    NotionClient sending its requests to a FakeNotion. Counts the requests per endpoint
+    """
+
+    def __init__(self, server: FakeNotion) -> None:
+        # Skips NotionClient.__init__ which sets up an http session and the login
+        self.server = server
+        self.calls: Counter = Counter()
+        self.session = None
+        self._store = RecordStore(self)
+        self._monitor = None
+        self._update_user_info()
+
+    def post(self, endpoint, data):
+        self.calls[endpoint] += 1
+        return FakeResponse(self.server.handle(endpoint, json_loads(json_dumps(data))))
@@ -1,6 +1,11 @@
 import asyncio
 import logging
 import os
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Set, Dict, Callable, ContextManager
 
 import click
 from functools import wraps
@@ -11,10 +16,26 @@ from notion.client import NotionClient
 
 from notionsy.local_provider import LocalProvider
 from notionsy.notion_provider import NotionProvider
+from notionsy.sync_estimator import SyncEstimator, SyncEstimate
+from notionsy.sync_journal import SyncJournal
 from notionsy.sync_merger import SyncMerger
-from notionsy.sync_planner import SyncPlanner, SyncConflictResolver, SyncActionTarget
+from notionsy.sync_mapping import SyncConfig
+from notionsy.sync_planner import SyncPlanner, SyncConflictResolver, SyncActionTarget, ORDERING_POLICIES, \
+    CONFLICT_POLICIES
+from notionsy.sync_roots import SyncRoot, sync_roots, run_roots, resolve_ancestors
+from notionsy.sync_state import STATE_BACKENDS, SyncData
+from notionsy.sync_tree import INTERNAL_FILES, Path
 from notionsy.syncer import Syncer
 from notionsy.templates import university
+from notionsy.utils.batcher import NotionBatcher
+from notionsy.utils.block_cache import BlockCache
+from notionsy.utils.downloader import Downloader
+from notionsy.utils.merge import MergeBase
+from notionsy.utils.notion import thread_local_transactions
+from notionsy.utils.rate_limit import RateLimiter
+from notionsy.utils.request_memo import RequestMemo
+from notionsy.utils.transport import create_client
+from notionsy.utils.watcher import create_watcher
 
 
 def config_provider(file_path, cmd_name):
@@ -25,7 +46,9 @@ def config_provider(file_path, cmd_name):
         config = yaml.full_load(config_data)
         return {
             **config['global'],
-            **config[cmd_name]
+            # Other commands share the sync configuration
+            **config.get('sync', {}),
+            **config.get(cmd_name, {})
         }
 
 
@@ -37,6 +60,27 @@ def coro(f):
     return wrapper
 
 
+class SyncRootType(click.ParamType):
+    """
+    Sync root given as a mapping with a notion_path and a local_path in the configuration file, or as
+    NOTION_PATH=LOCAL_PATH on the command line
+    """
+    name = 'root'
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, SyncRoot):
+            return value
+        if isinstance(value, dict):
+            if 'notion_path' not in value or 'local_path' not in value:
+                self.fail(f'Sync root requires a notion_path and a local_path: {value}', param, ctx)
+            return SyncRoot(value['notion_path'], value['local_path'])
+
+        notion_path, separator, local_path = str(value).rpartition('=')
+        if not separator:
+            self.fail(f'Sync root is not formatted as NOTION_PATH=LOCAL_PATH: {value}', param, ctx)
+        return SyncRoot(notion_path, local_path)
+
+
 @click.group()
 @click.option('-v', '--verbose', count=True)
 def cli(verbose):
@@ -44,44 +88,304 @@ def cli(verbose):
     pass
 
 
+SYNC_OPTIONS = [
+    click_config_file.configuration_option(provider=config_provider, config_file_name='config.yml'),
+    click.option('--token_v2'),
+    click.option('--notion_path'),
+    click.option('--local_path'),
+    click.option('--roots', type=SyncRootType(), multiple=True,
+                 help='More NOTION_PATH=LOCAL_PATH pairs synced by the same process'),
+    click.option('--root_workers', default=1, help='Number of independent roots synced concurrently'),
+    click.option('--clean', default=False),
+    click.option('--rate_limit', default=3.0, help='Maximum average number of Notion requests per second'),
+    click.option('--rate_burst', default=10, help='Maximum number of Notion requests in a burst'),
+    click.option('--full_fetch', is_flag=True, help='Fetch all Notion items instead of only the recently edited ones'),
+    click.option('--state_format', default='jsonl', type=click.Choice(list(STATE_BACKENDS.keys())),
+                 help='Storage format of the sync state'),
+    click.option('--write_batch_size', default=100,
+                 help='Maximum number of Notion write operations submitted together, 0 disables batching'),
+    click.option('--block_cache_size', default=100000,
+                 help='Maximum number of cached Notion blocks, 0 disables the cache'),
+    click.option('--download_workers', default=4, help='Maximum number of concurrent image downloads'),
+    click.option('--scan_workers', default=1, help='Number of directories listed in parallel, for slow file systems'),
+    click.option('--sync_workers', default=1, help='Number of independent sync actions executed concurrently'),
+    click.option('--notion_workers', default=0,
+                 help='Maximum number of concurrent Notion actions, 0 only bounds them by the sync workers'),
+    click.option('--local_workers', default=0,
+                 help='Maximum number of concurrent local actions, 0 only bounds them by the sync workers'),
+    click.option('--plan_order', default='tree', type=click.Choice(list(ORDERING_POLICIES.keys())),
+                 help='Order of the planned actions: tree order, structure before notes or most recent first'),
+    click.option('--conflict_policy', default='prompt', type=click.Choice(CONFLICT_POLICIES),
+                 help='Resolution of overlapping edits of a note on both sides'),
+    click.option('--snapshot_keep', default=10,
+                 help='Number of kept snapshots of the local files changed by a sync, 0 disables them'),
+    click.option('--dry_run', is_flag=True, help='Only print the sync plan with its estimated api usage and duration'),
+    click.option('--record', type=click.Path(dir_okay=False), help='Record all Notion requests to a cassette file'),
+    click.option('--replay', type=click.Path(exists=True, dir_okay=False),
+                 help='Answer all Notion requests from a recorded cassette file'),
+    click.option('--replay_latency', default=1.0,
+                 help='Scale of the recorded latency while replaying, 0 disables it'),
+]
+
+
+def sync_options(f):
+    for option in reversed(SYNC_OPTIONS):
+        f = option(f)
+    return f
+
+
+@cli.command()
+@sync_options
+@coro
+async def sync(
+        token_v2, notion_path, local_path, roots, root_workers, clean, rate_limit, rate_burst, full_fetch,
+        state_format, write_batch_size, block_cache_size, download_workers, scan_workers, sync_workers, notion_workers,
+        local_workers, plan_order, conflict_policy, snapshot_keep, dry_run, record, replay, replay_latency
+):
+    roots = sync_roots(notion_path, local_path, list(roots))
+    if not roots:
+        raise click.UsageError('Specify a notion_path and a local_path or a list of roots')
+
+    # All the roots share the client, so its session, rate limit and record store
+    client, transport = create_client(token_v2, record, replay, replay_latency)
+    if sync_workers > 1 or root_workers > 1:
+        # notion-py keeps the current transaction on the client, concurrent workers need one of their own
+        thread_local_transactions(client)
+    rate_limiter = RateLimiter(rate_limit, rate_burst)
+    rate_limiter.install(client)
+    batcher = NotionBatcher(write_batch_size, rate_limiter)
+    batcher.install(client)
+    memo = RequestMemo()
+    memo.install(client)
+
+    options = SyncOptions(
+        full_fetch=full_fetch, block_cache_size=block_cache_size, download_workers=download_workers,
+        scan_workers=scan_workers, sync_workers=sync_workers, notion_workers=notion_workers,
+        local_workers=local_workers, plan_order=plan_order, conflict_policy=conflict_policy,
+        snapshot_keep=snapshot_keep, dry_run=dry_run,
+    )
+
+    def sync_root(root: SyncRoot):
+        model = university.build_config(root.local_path, root.notion_path, client, rate_limiter)
+        data = model.data(STATE_BACKENDS[state_format]())
+        data.read()
+        run_sync(client, model, data, batcher, options)
+
+    try:
+        if len(roots) == 1:
+            with memo.share():
+                sync_root(roots[0])
+            return
+
+        with memo.share():
+            if root_workers > 1:
+                resolve_ancestors(client, roots)
+            failed = run_roots(roots, sync_root, root_workers)
+        if failed:
+            raise click.ClickException(f'Failed to sync {len(failed)} of {len(roots)} roots')
+    finally:
+        if transport:
+            transport.close()
+
+
 @cli.command()
-@click_config_file.configuration_option(provider=config_provider, config_file_name='config.yml')
-@click.option('--token_v2')
-@click.option('--notion_path')
-@click.option('--local_path')
-@click.option('--clean', default=False)
+@sync_options
+@click.option('--debounce', default=5.0, help='Seconds without local changes to wait for before syncing')
+@click.option('--interval', default=300.0, help='Maximum number of seconds between syncs to fetch Notion changes')
+@click.option('--poll', is_flag=True, help='Poll for local changes instead of using inotify')
+@click.option('--poll_interval', default=5.0, help='Seconds between the scans for local changes while polling')
 @coro
-async def sync(token_v2, notion_path, local_path, clean):
-    client = NotionClient(token_v2=token_v2)
-    model = university.build_config(local_path, notion_path, client)
-    data = model.data()
+async def watch(
+        token_v2, notion_path, local_path, roots, root_workers, clean, rate_limit, rate_burst, full_fetch,
+        state_format, write_batch_size, block_cache_size, download_workers, scan_workers, sync_workers, notion_workers,
+        local_workers, plan_order, conflict_policy, snapshot_keep, dry_run, record, replay, replay_latency, debounce,
+        interval, poll, poll_interval
+):
+    roots = sync_roots(notion_path, local_path, list(roots))
+    if len(roots) != 1:
+        raise click.UsageError('Watch syncs a single notion_path and local_path pair')
+    notion_path, local_path = roots[0].notion_path, roots[0].local_path
+
+    client, transport = create_client(token_v2, record, replay, replay_latency)
+    if sync_workers > 1:
+        # notion-py keeps the current transaction on the client, concurrent workers need one of their own
+        thread_local_transactions(client)
+    rate_limiter = RateLimiter(rate_limit, rate_burst)
+    rate_limiter.install(client)
+    batcher = NotionBatcher(write_batch_size, rate_limiter)
+    batcher.install(client)
+    memo = RequestMemo()
+    memo.install(client)
+    options = SyncOptions(
+        full_fetch=full_fetch, block_cache_size=block_cache_size, download_workers=download_workers,
+        scan_workers=scan_workers, sync_workers=sync_workers, notion_workers=notion_workers,
+        local_workers=local_workers, plan_order=plan_order, conflict_policy=conflict_policy,
+        snapshot_keep=snapshot_keep, dry_run=dry_run,
+    )
+    model = university.build_config(local_path, notion_path, client, rate_limiter)
+    data = model.data(STATE_BACKENDS[state_format]())
     data.read()
 
-    local_provider = LocalProvider(model)
-    local_provider.fetch_tree(data.local_tree)
-    notion_provider = NotionProvider(client, model)
-    notion_provider.fetch_tree(data.notion_tree)
+    watcher = create_watcher(local_path, INTERNAL_FILES, poll, poll_interval)
+    logging.info(f'Watching {local_path} for changes with {type(watcher).__name__}')
+    changes = watcher.changes()
+    try:
+        while True:
+            try:
+                with memo.share():
+                    run_sync(client, model, data, batcher, options, changes)
+                # Files written by the sync are scanned with the next sync without triggering it. A dry run does
+                # not store the scanned changes
+                changes = merge_changes(changes, watcher.changes()) if dry_run else watcher.changes()
+            except Exception as e:
+                logging.exception(e)
+                # Start over from the stored state with a full scan
+                data.read()
+                changes = None
 
-    merger = SyncMerger()
-    merged_tree = merger.merge_nodes(model.hierarchy, data.local_tree, data.notion_tree)
+            deadline = time.monotonic() + interval
+            if watcher.wait(deadline - time.monotonic()):
+                changes = merge_changes(changes, watcher.changes())
+                while watcher.wait(debounce):
+                    changes = merge_changes(changes, watcher.changes())
+            changes = merge_changes(changes, watcher.changes())
+            logging.info(f'Syncing {"all" if changes is None else len(changes)} local changes')
+    except KeyboardInterrupt:
+        logging.info('Stopped watching')
+    finally:
+        watcher.close()
+        if transport:
+            transport.close()
 
-    planner = SyncPlanner()
-    plan = planner.plan(merged_tree)
-    resolver = SyncConflictResolver()
-    plan = resolver.resolve(plan)
+
+@dataclass
+class SyncOptions:
+    """
+    Options of a single sync of a root, as given to the sync and watch commands
+    """
+    full_fetch: bool = False
+    block_cache_size: int = 100000
+    download_workers: int = 4
+    scan_workers: int = 1
+    # Number of concurrently executed sync actions
+    sync_workers: int = 1
+    # Maximum number of concurrent sync actions per target, 0 for no limit
+    notion_workers: int = 0
+    local_workers: int = 0
+    # Name of the ordering policy of the planner
+    plan_order: str = 'tree'
+    # Resolution of the note conflicts which can not be merged
+    conflict_policy: str = 'prompt'
+    # Number of kept snapshots of the local files changed by a sync
+    snapshot_keep: int = 10
+    dry_run: bool = False
+
+    @property
+    def target_workers(self) -> Dict[SyncActionTarget, int]:
+        return {SyncActionTarget.NOTION: self.notion_workers, SyncActionTarget.LOCAL: self.local_workers}
+
+
+def run_sync(
+        client: NotionClient, model: SyncConfig, data: SyncData, batcher: NotionBatcher, options: SyncOptions,
+        changes: Optional[Set[Path]] = None, phase: Callable[[str], ContextManager] = lambda name: nullcontext()
+) -> Optional[SyncEstimate]:
+    """
+    Syncs the local directory and the notion page of the model once
+    :param client:
+    :param model:
+    :param data: sync state, which is updated to the synced trees
+    :param batcher: batcher installed on the client, which queues the notion writes of the sync actions
+    :param options:
+    :param changes: local paths which changed since the state was written, None scans the whole directory
+    :param phase: context manager entered around every phase of the sync with its name, e.g. to time the phases
+    :return: the estimate of the plan on a dry run
+    """
+    local_path = model.root_dir
+
+    # Resume the progress of an interrupted sync
+    journal = SyncJournal(local_path, before_flush=batcher.flush)
+    resumed = journal.replay(data)
+    if resumed > 0 and not options.dry_run:
+        logging.info(f'Resuming interrupted sync: {resumed} actions were already completed')
+        data.write()
+        journal.clear()
+
+    local_provider = LocalProvider(model, options.scan_workers, options.snapshot_keep)
+    with phase('local_fetch'):
+        local_provider.fetch_tree(data.local_tree, changes)
+    block_cache = BlockCache(local_path, client, options.block_cache_size) if options.block_cache_size > 0 else None
+    downloader = Downloader(options.download_workers)
+    notion_provider = NotionProvider(
+        client, model, incremental=not options.full_fetch, block_cache=block_cache, downloader=downloader
+    )
+    notion_fetched_at = datetime.now()
+    with phase('notion_fetch'):
+        if block_cache:
+            block_cache.read()
+        notion_provider.fetch_tree(data.notion_tree)
+
+    with phase('merge'):
+        merger = SyncMerger()
+        merged_tree = merger.merge_nodes(model.hierarchy, data.local_tree, data.notion_tree)
+
+    providers = {
+        SyncActionTarget.LOCAL: local_provider,
+        SyncActionTarget.NOTION: notion_provider
+    }
+    merge_base = MergeBase(local_path)
+    with phase('plan'):
+        planner = SyncPlanner(ORDERING_POLICIES[options.plan_order])
+        plan = planner.plan(merged_tree)
+        # A dry run does not fetch the conflicting contents to merge them
+        resolver = SyncConflictResolver(
+            options.conflict_policy, merge_base,
+            None if options.dry_run else lambda action: providers[action.action_target].action_downstream(action)
+        )
+        plan = resolver.resolve(plan)
     logging.info('============== SYNC PLAN ===============')
     for a in plan:
         logging.info(a)
     logging.info('============ END SYNC PLAN =============')
 
-    syncer = Syncer({
-        SyncActionTarget.LOCAL: local_provider,
-        SyncActionTarget.NOTION: notion_provider
-    })
-    syncer.sync(plan)
+    if options.dry_run:
+        estimator = SyncEstimator(model, block_cache, batcher.max_operations)
+        estimate = estimator.estimate_plan(plan)
+        estimator.report(estimate)
+        downloader.close()
+        return estimate
+
+    with phase('sync'):
+        local_provider.snapshot(plan)
+
+        # Checkpoint the fetched trees so the journal can be replayed onto them
+        data.write()
+        journal.begin()
+
+        syncer = Syncer(providers, journal, options.sync_workers, options.target_workers, merge_base)
+        try:
+            with batcher.batch():
+                syncer.sync(plan)
+        finally:
+            journal.close()
+            downloader.close()
+
+    with phase('state_write'):
+        data.apply(merged_tree)
+        data.notion_tree.notion_synced_at = notion_fetched_at
+        data.write()
+        journal.clear()
+        local_provider.hash_cache.write()
+        if block_cache:
+            block_cache.write()
+    if block_cache:
+        logging.info(block_cache.summary())
+
 
-    data.apply(merged_tree)
-    data.write()
+def merge_changes(changes: Optional[Set[Path]], other: Optional[Set[Path]]) -> Optional[Set[Path]]:
+    # Unknown changes require a full scan
+    if changes is None or other is None:
+        return None
+    return changes | other
 
 
 if __name__ == "__main__":
@@ -2,20 +2,36 @@ import logging
 import mimetypes
 import os
 import shutil
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Optional, Union
+from functools import lru_cache
+from typing import Optional, Union, Set, Iterable
 
 from notionsy.base_provider import BaseProvider
 from notionsy.sync_planner import SyncAction, SyncActionTarget, SyncActionType
 from notionsy.sync_tree import Path, SyncTree, SyncNode, SyncMetadataLocal, TREE_FILENAME, SyncNodeType, \
     INTERNAL_FILES
 from notionsy.sync_mapping import Mapping, SyncConfig
+from notionsy.utils.hash_cache import HashCache
+from notionsy.utils.scanner import DirectoryScanner, is_dir
+from notionsy.utils.snapshot import SnapshotStore
+from notionsy.utils.watcher import affected_paths
 
 
 @dataclass
 class LocalProvider(BaseProvider):
     model: SyncConfig
+    scan_workers: int = 1
+    # Number of kept snapshots of the files changed by a sync, 0 disables them
+    snapshot_keep: int = 10
+    hash_cache: HashCache = field(init=False)
+    scanner: DirectoryScanner = field(init=False)
+    snapshots: SnapshotStore = field(init=False)
+
+    def __post_init__(self):
+        self.hash_cache = HashCache(self.root_dir)
+        self.scanner = DirectoryScanner(self.root_dir, INTERNAL_FILES, self.scan_workers)
+        self.snapshots = SnapshotStore(self.root_dir, self.snapshot_keep)
 
     @property
     def mapping(self) -> Mapping:
@@ -25,56 +41,71 @@ class LocalProvider(BaseProvider):
     def root_dir(self) -> Path:
         return self.model.root_dir
 
-    def fetch_tree(self, tree: SyncTree) -> SyncTree:
+    def fetch_tree(self, tree: SyncTree, changes: Optional[Set[Path]] = None) -> SyncTree:
         """
         Syncs all the local data to the given sync tree
         :param tree:
+        :param changes: paths relative to the root dir which changed since the tree was last fetched. Only these
+        and their ancestors are scanned. None scans everything
         :return:
         """
-        return self.fetch_node(self.root_dir, tree)
-
-    def fetch_node(self, path: Path, node: Union[SyncNode, SyncTree]) -> Union[SyncNode, SyncTree]:
+        affected = affected_paths(changes) if changes is not None else None
+        self.hash_cache.read()
+        # Stat results are only valid for a single scan
+        self.scanner = DirectoryScanner(self.root_dir, INTERNAL_FILES, self.scan_workers)
+        self.scanner.prefetch(affected)
+        # The hash cache is written once the sync completed, so a dry run leaves the directory untouched
+        return self.fetch_node(self.root_dir, tree, affected)
+
+    def fetch_node(
+            self, path: Path, node: Union[SyncNode, SyncTree], affected: Optional[Set[Path]] = None
+    ) -> Union[SyncNode, SyncTree]:
         """
         Syncs local data to the given tree
         :param path:
         :param node:
+        :param affected: paths which need to be scanned, None scans the whole node
         :return:
         """
         if node.metadata_local.deleted:
             return node
 
         node_path = os.path.join(path, node.metadata_local.path)
+        rel_path = os.path.relpath(node_path, self.root_dir)
+        if affected is not None and rel_path not in affected:
+            return node
 
         # Check if current node exists
-        if not os.path.exists(node_path):
+        stat = self.scanner.stat(rel_path)
+        if stat is None:
             node.metadata_local.deleted = True
+            self.hash_cache.discard(rel_path)
             return node
 
         # Update node
-        node.node_role = self.mapping.match(format_path(self.root_dir, os.path.relpath(node_path, self.root_dir)))
+        is_folder = is_dir(stat)
+        node.node_role = self.mapping.match(format_path(self.root_dir, rel_path, is_folder))
         node.metadata_local.updated_at = max(
             node.metadata_local.updated_at,
-            datetime.fromtimestamp(os.path.getmtime(node_path))
+            datetime.fromtimestamp(stat.st_mtime)
         )
 
         # Handle standalone files (leaves)
-        if os.path.isfile(node_path):
+        if not is_folder:
+            node.metadata_local.digest = self.hash_cache.digest(rel_path, stat)
             return node
 
-        # Check for new items
+        # Check for new items, internal files are skipped by the scanner
+        existing = len(node.children)
         children = {child.metadata_local.path: child for child in node.children}
-        for item in os.listdir(os.path.join(path, node.metadata_local.path)):
-            # Skip internal files
-            if item in INTERNAL_FILES:
-                continue
-
+        for item, item_stat in (self.scanner.listing(rel_path) or {}).items():
             # Remove valid children from the memo
             if item in children:
                 children.pop(item)
                 continue
 
             # Create the new child since it doent exist yet
-            child = self.create_node(node_path, node, item)
+            child = self.create_node(node_path, node, item, is_dir(item_stat))
             if child:
                 node.children.append(child)
 
@@ -82,26 +113,30 @@ class LocalProvider(BaseProvider):
         for (_, child) in children.items():
             child.metadata_notion.deleted = True
 
-        # Update children
-        for child in node.children:
-            self.fetch_node(node_path, child)
+        # Update children. New and missing children are scanned as a whole
+        for i, child in enumerate(node.children):
+            whole = i >= existing or child.metadata_local.path in children
+            self.fetch_node(node_path, child, None if whole else affected)
 
         return node
 
-    def create_node(self, path: Path, parent: SyncNode, item: Path) -> Optional[SyncNode]:
+    def create_node(
+            self, path: Path, parent: SyncNode, item: Path, is_folder: Optional[bool] = None
+    ) -> Optional[SyncNode]:
         """
         Creates a new local node
         :param path:
         :param parent:
         :param item:
+        :param is_folder: whether the item is a directory, checked on disk if unknown
         :return:
         """
         node_path = os.path.join(path, item)
-        is_folder = os.path.isdir(node_path)
-        mime, _ = mimetypes.guess_type(node_path)
+        if is_folder is None:
+            is_folder = os.path.isdir(node_path)
 
         # Only folders and textual files allowed
-        if not is_folder and (not mime or not mime.startswith('text')):
+        if not is_folder and not is_text(os.path.splitext(item)[1]):
             return None
 
         return SyncNode(
@@ -109,6 +144,37 @@ class LocalProvider(BaseProvider):
             metadata_local=SyncMetadataLocal(item)
         )
 
+    def snapshot(self, actions: Iterable[SyncAction]) -> Optional[Path]:
+        """
+        Takes a snapshot of the local files the given actions will overwrite or delete
+        :param actions: planned actions
+        :return: path of the snapshot, None if no existing file is affected or snapshots are disabled
+        """
+        if not self.snapshots.enabled:
+            return None
+
+        paths = list(filter(None, map(self.affected_path, actions)))
+        snapshot = self.snapshots.snapshot(paths, self.hash_cache.digest)
+        self.snapshots.collect()
+        return snapshot
+
+    def affected_path(self, action: SyncAction) -> Optional[Path]:
+        """
+        Local path the given action overwrites or deletes
+        :param action:
+        :return: path relative to the root dir
+        """
+        node = action.node
+        if action.action_target == SyncActionTarget.NOTION and action.action_type == SyncActionType.FETCH:
+            # Notes of groups which do not exist locally yet can not overwrite any file
+            if node.node_type == SyncNodeType.NOTE and (node.parent is None or node.parent.metadata_local is not None):
+                return os.path.join(node.local_dir(), f'{node.metadata_notion.title}.md')
+        elif action.action_target == SyncActionTarget.LOCAL and action.action_type == SyncActionType.DELETE:
+            return node.local_path()
+        elif action.action_type == SyncActionType.MERGE:
+            return node.local_path()
+        return None
+
     def action_upstream(self, action: SyncAction):
         assert action.action_target == SyncActionTarget.NOTION
         if action.action_type == SyncActionType.FETCH:
@@ -119,7 +185,8 @@ class LocalProvider(BaseProvider):
                     f.write(action.content)
                 action.node.metadata_local = SyncMetadataLocal(
                     path=filename,
-                    updated_at=datetime.now()
+                    updated_at=datetime.now(),
+                    digest=self.hash_cache.digest(os.path.relpath(filepath, self.root_dir))
                 )
             elif action.node.node_type == SyncNodeType.GROUP:
                 filename = action.node.metadata_notion.title
@@ -129,7 +196,7 @@ class LocalProvider(BaseProvider):
                     path=filename,
                     updated_at=datetime.now()
                 )
-            action.node.synced_at = datetime.now()
+            action.node.mark_synced()
 
     def action_downstream(self, action: SyncAction):
         assert action.action_target == SyncActionTarget.LOCAL
@@ -142,11 +209,26 @@ class LocalProvider(BaseProvider):
             if action.node.node_type == SyncNodeType.NOTE:
                 with open(os.path.join(self.root_dir, action.node.local_path()), 'r') as f:
                     action.content = f.read()
+        elif action.action_type == SyncActionType.MERGE:
+            # Write the merged content, which is uploaded upstream
+            filepath = os.path.join(self.root_dir, action.node.local_path())
+            with open(filepath, 'w') as f:
+                f.write(action.content)
+            action.node.metadata_local.updated_at = datetime.now()
+            action.node.metadata_local.digest = self.hash_cache.digest(os.path.relpath(filepath, self.root_dir))
 
 
-def format_path(root_dir: Path, path: Path) -> Path:
+def format_path(root_dir: Path, path: Path, is_folder: Optional[bool] = None) -> Path:
     if path == '.':
         return '.'
-    if os.path.isdir(os.path.join(root_dir, path)):
+    if is_folder is None:
+        is_folder = os.path.isdir(os.path.join(root_dir, path))
+    if is_folder:
         return path.rstrip('/') + '/'
     return path
+
+
+@lru_cache(maxsize=None)
+def is_text(extension: str) -> bool:
+    mime, _ = mimetypes.guess_type(f'file{extension}')
+    return bool(mime) and mime.startswith('text')
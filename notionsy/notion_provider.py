@@ -2,18 +2,20 @@ import io
 import logging
 import os
 from dataclasses import field, dataclass
-from datetime import datetime, timezone
-from itertools import groupby
-from typing import Union, Dict, List
+from datetime import datetime, timezone, timedelta
+from typing import Union, Dict, List, Optional, Set
+from uuid import UUID
 
 from notion.client import NotionClient
 from notion.collection import CollectionRowBlock, Collection
 
 from notionsy.base_provider import BaseProvider
 from notionsy.sync_planner import SyncAction, SyncActionTarget, SyncActionType
-from notionsy.sync_tree import SyncTree, GUID, SyncNode, SyncMetadataNotion, SyncNodeType, Path
+from notionsy.sync_tree import SyncTree, GUID, SyncNode, SyncMetadataNotion, SyncNodeType, Path, SyncNodeRole
 from notionsy.sync_mapping import Mapping, ResourceAction, SyncConfig
 from notionsy.utils.notion import iterate, default_dt, to_local_dt
+from notionsy.utils.block_cache import BlockCache
+from notionsy.utils.downloader import Downloader
 from notionsy.utils.notion2md import NotionMarkdownExporter
 
 
@@ -21,6 +23,9 @@ from notionsy.utils.notion2md import NotionMarkdownExporter
 class NotionProvider(BaseProvider):
     client: NotionClient
     model: SyncConfig
+    incremental: bool = True
+    block_cache: Optional[BlockCache] = None
+    downloader: Optional[Downloader] = None
 
     @property
     def mapping(self) -> Mapping:
@@ -32,13 +37,17 @@ class NotionProvider(BaseProvider):
 
     def fetch_tree(self, tree: SyncTree) -> SyncTree:
         """
-        Syncs the whole tree based on the given root page
+        Syncs the whole tree based on the given root page. In incremental mode only the items edited since
+        the last successful sync are fetched
         :param tree:
         :return:
         """
         page = self.client.get_block(tree.metadata_notion.id)
         children = {child.metadata_notion.id: child for child in tree.children}
         tree.metadata_notion.title = page.title
+        since = tree.notion_synced_at if self.incremental else None
+        if since:
+            logging.debug(f'Fetching notion items edited since: {since}')
 
         # Create new children or reuse existing ones if needed
         for group in iterate(page):
@@ -48,7 +57,7 @@ class NotionProvider(BaseProvider):
                 node = self.create_node(group.id, group.title, tree)
                 tree.children.append(node)
 
-            self.fetch_group(node, group)
+            self.fetch_group(node, group, since)
 
         # Unused children are deleted
         for (_, child) in children.items():
@@ -58,11 +67,14 @@ class NotionProvider(BaseProvider):
         self.link_relations(tree)
         return tree
 
-    def fetch_group(self, node: SyncNode, group: CollectionRowBlock) -> Union[SyncNode, SyncTree]:
+    def fetch_group(
+            self, node: SyncNode, group: CollectionRowBlock, since: Optional[datetime] = None
+    ) -> Union[SyncNode, SyncTree]:
         """
         Syncs inline listviews within the main page
         :param node:
         :param group:
+        :param since: only fetch items edited after this date if given
         :return:
         """
         if node.metadata_notion.deleted:
@@ -76,15 +88,15 @@ class NotionProvider(BaseProvider):
         )
 
         children = {child.metadata_notion.id: child for child in node.children}
-        notion_children = group.views[0].build_query(
-            sort=[{"direction": "descending", "property": "updated"}],
-            # filter={"filters": [
-            #     filter_date_after('updated', node.metadata_notion.updated_at)
-            # ], "operator": "and"}
-        )
+        if since is None:
+            notion_children = iterate(group.views[0].build_query(
+                sort=[{"direction": "descending", "property": "updated"}],
+            ))
+        else:
+            notion_children = self.fetch_group_delta(group, children, since)
 
         # Create new children or reuse existing ones if needed
-        for item in iterate(notion_children):
+        for item in notion_children:
             if item.id in children:
                 child = children.pop(item.id)
             else:
@@ -98,6 +110,30 @@ class NotionProvider(BaseProvider):
 
         return node
 
+    def fetch_group_delta(
+            self, group: CollectionRowBlock, children: Dict[GUID, SyncNode], since: datetime
+    ) -> List[CollectionRowBlock]:
+        """
+        Returns the items of the group edited since the given date and items which are not known yet. A single
+        listing of the group finds both, while deleted items are missing from it. Known items which still exist are
+        removed from the children memo so they are not marked as deleted
+        :param group:
+        :param children: memo of the known children by notion id
+        :param since:
+        :return:
+        """
+        # Notion stores edit times by the minute, in milliseconds since the epoch
+        since_ms = (since - timedelta(minutes=1)).timestamp() * 1000
+        items = []
+        for item in group.views[0].build_query().execute():
+            # The raw record is read, since the mapped properties are resolved through the schema on every access
+            updated_ms = item.get('last_edited_time') if item.id in children else None
+            if updated_ms is not None and updated_ms < since_ms:
+                children.pop(item.id)
+            else:
+                items.append(item)
+        return items
+
     def fetch_item(self, group_path: str, node: SyncNode, item: CollectionRowBlock):
         """
         Syncs individual pages
@@ -128,28 +164,32 @@ class NotionProvider(BaseProvider):
 
     def link_relations(self, tree: SyncTree):
         """
-        Adds addittional parent to child links for linked items
+        Adds addittional parent to child links for linked items. Relations are resolved through a single
+        notion id index of the tree
         :param tree:
         :return:
         """
-        grouped = {k: list(v) for k, v in groupby(tree.flatten(), lambda i: i.node_role)}
-        grouped.pop(None)
-
-        for items in grouped.values():
-            for item in items:
-                if len(item.metadata_notion.relations) == 0:
-                    continue
-
-                for parent_role, parents in item.metadata_notion.relations.items():
-                    parent_items = filter(lambda i: i.metadata_notion.id in parents, grouped[parent_role])
-                    for parent in parent_items:
-                        # TODO: do we need to check for duplicates?
-                        item.parent = parent
+        index = {node.metadata_notion.id: node for node in tree.traverse() if node.metadata_notion}
+        linked: Dict[GUID, Set[UUID]] = {}
+
+        for item in list(index.values()):
+            if not item.node_role or len(item.metadata_notion.relations) == 0:
+                continue
+
+            for parent_role, parents in item.metadata_notion.relations.items():
+                for parent_id in parents:
+                    parent = index.get(parent_id)
+                    if parent is None or parent.node_role != parent_role:
+                        continue
+
+                    item.parent = parent
+                    children = linked.get(parent_id)
+                    if children is None:
+                        children = linked[parent_id] = {c.id for c in parent.children}
+                    if item.id not in children:
+                        children.add(item.id)
                         parent.children.append(item)
 
-        for node in tree.traverse():
-            node.children = list({c.id: c for c in node.children}.values())
-
     def create_node(self, id: GUID, title: str, parent: SyncNode):
         return SyncNode(
             parent=parent, node_type=SyncNodeType.GROUP,
@@ -157,22 +197,27 @@ class NotionProvider(BaseProvider):
         )
 
     def extract_role_parents(self, tree: SyncTree):
-        grouped = {k: list(v) for k, v in groupby(tree.flatten(), lambda i: i.node_role)}
-        grouped.pop(None)
-
-        def find_parent(nodes: List[SyncNode]) -> SyncNode:
-            for node in nodes:
-                if node.parent and not node.parent.node_role:
-                    return node.parent
+        """
+        Finds for every role the role-less node (collection) containing its items
+        :param tree:
+        :return:
+        """
+        content_mapping: Dict[SyncNodeRole, Optional[SyncNode]] = {}
+        for node in tree.traverse():
+            if node.node_role is None:
+                continue
+            if content_mapping.get(node.node_role) is None:
+                content_mapping[node.node_role] = \
+                    node.parent if node.parent and not node.parent.node_role else None
 
-        self.model.resource_mapper.content_mapping = {k: find_parent(v) for k, v in grouped.items()}
+        self.model.resource_mapper.content_mapping = content_mapping
 
     def action_upstream(self, action: SyncAction):
         assert action.action_target == SyncActionTarget.LOCAL
-        if action.action_type == SyncActionType.FETCH and action.node.node_role:
+        if action.action_type in (SyncActionType.FETCH, SyncActionType.MERGE) and action.node.node_role:
             resource_action = ResourceAction.CREATE if action.should_create else ResourceAction.UPDATE
             self.model.resource_mapper.execute(resource_action, action.node.node_role, action)
-            action.node.synced_at = datetime.now()
+            action.node.mark_synced()
 
     def action_downstream(self, action: SyncAction):
         assert action.action_target == SyncActionTarget.NOTION
@@ -184,7 +229,9 @@ class NotionProvider(BaseProvider):
         elif action.action_type == SyncActionType.FETCH:
             if action.node.node_type == SyncNodeType.NOTE:
                 exporter = NotionMarkdownExporter(
-                    image_dir=os.path.join(self.root_dir, action.node.local_dir(), 'resources')
+                    image_dir=os.path.join(self.root_dir, action.node.local_dir(), 'resources'),
+                    block_cache=self.block_cache,
+                    downloader=self.downloader
                 )
                 page = self.client.get_block(action.node.metadata_notion.id)
                 action.content = exporter.export_page(page)
@@ -0,0 +1,163 @@
+import logging
+import math
+import os
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from notionsy.sync_mapping import SyncConfig, ResourceAction
+from notionsy.sync_planner import SyncAction, SyncActionTarget, SyncActionType
+from notionsy.sync_tree import SyncNodeType
+from notionsy.utils.block_cache import BlockCache
+
+# Rough request counts of the notion-py operations used while syncing
+CALLS_PER_PAGE_EXPORT = 1  # getRecordValues of the children, the page itself comes with the collection query
+CALLS_PER_CACHED_EXPORT = 1  # page record to validate the cached blocks
+CALLS_PER_DELETE = 1  # get_block
+WRITES_PER_DELETE = 1  # removal of the block
+# notion-py adds last edited updates of the touched blocks to every write transaction
+OPERATIONS_PER_WRITE = 4
+
+
+@dataclass
+class SyncEstimate:
+    """
+    Estimated cost of one or more sync actions. Write transactions are counted apart in `writes`, since batching
+    submits many of them in a single request. The estimator folds them into `api_calls` once an action is estimated
+    """
+    api_calls: int = 0
+    blocks: int = 0
+    download_bytes: int = 0
+    upload_bytes: int = 0
+    writes: int = 0
+
+    def __add__(self, other: 'SyncEstimate') -> 'SyncEstimate':
+        return SyncEstimate(
+            self.api_calls + other.api_calls,
+            self.blocks + other.blocks,
+            self.download_bytes + other.download_bytes,
+            self.upload_bytes + other.upload_bytes,
+            self.writes + other.writes,
+        )
+
+    def __str__(self) -> str:
+        return f'{self.api_calls} calls, {self.blocks} blocks, ' \
+               f'{format_bytes(self.download_bytes)} down, {format_bytes(self.upload_bytes)} up'
+
+
+@dataclass
+class SyncEstimator:
+    """
+    Estimates the notion api usage and duration of a sync plan without executing it
+    """
+    model: SyncConfig
+    block_cache: Optional[BlockCache] = None
+    write_batch_size: int = 0
+    latency: float = 0.3
+    estimates: List[Tuple[SyncAction, SyncEstimate]] = field(default_factory=lambda: [])
+
+    def estimate_plan(self, plan: List[SyncAction]) -> SyncEstimate:
+        """
+        Estimates all the actions of the plan
+        :param plan:
+        :return: estimate of the whole plan
+        """
+        self.estimates = [(action, self.estimate(action)) for action in plan]
+        total = SyncEstimate()
+        for _, estimate in self.estimates:
+            total += estimate
+        return total
+
+    def estimate(self, action: SyncAction) -> SyncEstimate:
+        """
+        Estimates the cost of a single action, mirroring what the providers would do to execute it
+        :param action:
+        :return:
+        """
+        estimate = SyncEstimate()
+        node = action.node
+        if action.action_target == SyncActionTarget.NOTION:
+            if action.action_type == SyncActionType.DELETE:
+                estimate.api_calls += CALLS_PER_DELETE
+                estimate.writes += WRITES_PER_DELETE
+            elif action.action_type == SyncActionType.FETCH and node.node_type == SyncNodeType.NOTE:
+                estimate.api_calls += CALLS_PER_CACHED_EXPORT if self.is_cached(action) else CALLS_PER_PAGE_EXPORT
+                # The previous export is the best guess of the size of the page
+                if node.metadata_local and not node.metadata_local.deleted:
+                    estimate.download_bytes += self.local_size(action)
+        elif action.action_type in (SyncActionType.FETCH, SyncActionType.MERGE) and node.node_role:
+            if node.node_type == SyncNodeType.NOTE:
+                # Merges carry their content already
+                if action.action_type == SyncActionType.FETCH:
+                    action.content = self.read_local(action)
+                estimate.upload_bytes += len(action.content.encode('utf-8'))
+            resource_action = ResourceAction.CREATE if action.should_create else ResourceAction.UPDATE
+            mapped = self.model.resource_mapper.estimate(resource_action, node.node_role, action)
+            if mapped is not None:
+                estimate += mapped
+        estimate.api_calls += self.write_calls(estimate.writes)
+        return estimate
+
+    def write_calls(self, writes: int) -> int:
+        """
+        Number of requests submitting the write transactions of one action. The reads of the next action flush the
+        batch, so the writes of an action are assumed to be submitted on their own
+        :param writes:
+        :return:
+        """
+        if self.write_batch_size <= 0:
+            return writes
+        return math.ceil(writes * OPERATIONS_PER_WRITE / self.write_batch_size)
+
+    def duration(self, estimate: SyncEstimate) -> float:
+        """
+        Expected duration in seconds of the estimated requests when executed one after another under the
+        configured rate limit
+        :param estimate:
+        :return:
+        """
+        duration = estimate.api_calls * self.latency
+        limiter = self.model.rate_limiter
+        if limiter is not None and limiter.enabled:
+            duration = max(duration, (estimate.api_calls - limiter.burst) / limiter.rate)
+        return duration
+
+    def report(self, total: SyncEstimate):
+        logging.info('============ SYNC ESTIMATE =============')
+        for action, estimate in self.estimates:
+            logging.info(f'{action}\n\t{estimate}, ~{format_duration(self.duration(estimate))}')
+        logging.info(f'TOTAL: {len(self.estimates)} actions, {total}, ~{format_duration(self.duration(total))}')
+        logging.info('========== END SYNC ESTIMATE ===========')
+
+    def is_cached(self, action: SyncAction) -> bool:
+        if self.block_cache is None:
+            return False
+        page = self.block_cache.client.get_block(action.node.metadata_notion.id)
+        return page is not None and self.block_cache.is_fresh(page)
+
+    def local_size(self, action: SyncAction) -> int:
+        try:
+            return os.path.getsize(os.path.join(self.model.root_dir, action.node.local_path()))
+        except OSError:
+            return 0
+
+    def read_local(self, action: SyncAction) -> str:
+        try:
+            with open(os.path.join(self.model.root_dir, action.node.local_path()), 'r') as f:
+                return f.read()
+        except OSError as e:
+            logging.warning(f'Could not read {action.node.local_path()} for the estimate: {e}')
+            return ''
+
+
+def format_bytes(size: int) -> str:
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return f'{size:.0f}{unit}'
+        size /= 1024
+    return f'{size:.1f}GB'
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h{minutes:02d}m{seconds:02d}s' if hours else f'{minutes}m{seconds:02d}s'
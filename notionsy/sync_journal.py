@@ -0,0 +1,127 @@
+import logging
+import os
+from typing import List, Optional, BinaryIO, Dict, Callable
+from uuid import UUID
+
+from notionsy.sync_planner import SyncAction
+from notionsy.sync_state import SyncData, Record, encode_dt, decode_dt, encode_metadata_notion, \
+    encode_metadata_local, decode_metadata_notion, decode_metadata_local
+from notionsy.sync_tree import Path, SyncNode, JOURNAL_FILENAME
+from notionsy.utils.serialization import json_dumps, json_loads
+
+
+class SyncJournal:
+    """
+    Append-only journal of the completed sync actions. Every record stores the resulting sync metadata of the
+    action's node, so an interrupted sync can be resumed by replaying the journal onto the last written state
+    """
+    root_dir: Path
+    batch_size: int
+    # Called before the records are made durable, so the writes of the recorded actions can be completed first
+    before_flush: Optional[Callable[[], None]]
+
+    def __init__(
+            self, root_dir: Path, batch_size: int = 10, before_flush: Optional[Callable[[], None]] = None
+    ) -> None:
+        super().__init__()
+        self.root_dir = root_dir
+        self.batch_size = batch_size
+        self.before_flush = before_flush
+        self.buffer: List[bytes] = []
+        self.file: Optional[BinaryIO] = None
+
+    @property
+    def path(self) -> Path:
+        return os.path.join(self.root_dir, JOURNAL_FILENAME)
+
+    def replay(self, data: SyncData) -> int:
+        """
+        Applies the journaled actions onto the given sync data
+        :param data:
+        :return: number of replayed actions
+        """
+        if not os.path.exists(self.path):
+            return 0
+
+        nodes: Dict[UUID, List[SyncNode]] = {}
+        for tree in [data.notion_tree, data.local_tree]:
+            for node in tree.traverse():
+                nodes.setdefault(node.id, []).append(node)
+
+        count = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record: Record = json_loads(line)
+                except ValueError:
+                    # The last record may be torn if the sync was killed while writing it
+                    logging.warning(f'Skipping corrupt journal record: {line}')
+                    continue
+
+                targets = nodes.get(UUID(record['id']))
+                if not targets:
+                    logging.debug(f'Skipping journal record for unknown node: {record["id"]}')
+                    continue
+
+                metadata_notion = decode_metadata_notion(record['notion']) if record['notion'] else None
+                metadata_local = decode_metadata_local(record['local']) if record['local'] else None
+                for node in targets:
+                    node.metadata_notion = metadata_notion
+                    node.metadata_local = metadata_local
+                    node.synced_at = decode_dt(record['synced_at'])
+                count += 1
+
+        logging.debug(f'Replayed {count} journaled actions from: {self.path}')
+        return count
+
+    def begin(self):
+        """
+        Starts a new journal. Should be called once the state the journal applies to is written
+        :return:
+        """
+        self.close()
+        self.file = open(self.path, 'wb')
+
+    def record(self, action: SyncAction):
+        """
+        Records the given action as completed. Records are made durable in batches
+        :param action:
+        :return:
+        """
+        node = action.node
+        self.buffer.append(json_dumps({
+            'id': str(node.id),
+            'action': action.action_type.value,
+            'target': action.action_target.value,
+            'synced_at': encode_dt(node.synced_at),
+            'notion': encode_metadata_notion(node.metadata_notion) if node.metadata_notion else None,
+            'local': encode_metadata_local(node.metadata_local) if node.metadata_local else None,
+        }) + b'\n')
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.file is None or len(self.buffer) == 0:
+            return
+        if self.before_flush is not None:
+            self.before_flush()
+        self.file.write(b''.join(self.buffer))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer = []
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+
+    def clear(self):
+        """
+        Removes the journal once its actions are part of the written state
+        :return:
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
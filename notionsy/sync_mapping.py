@@ -1,12 +1,17 @@
+import logging
 import re
 from dataclasses import field, dataclass
 from enum import Enum
+from functools import lru_cache
 from typing import Dict, List, Tuple, Pattern, AnyStr, Optional, Set
 
 from notionsy.sync_planner import SyncAction
-from notionsy.sync_tree import SyncNodeRole, SyncNode, Path, SyncNodeType, GUID, SyncData, SyncTree
+from notionsy.sync_state import SyncData, StateBackend
+from notionsy.sync_tree import SyncNodeRole, SyncNode, Path, SyncNodeType, GUID, SyncTree
+from notionsy.utils.rate_limit import RateLimiter
 
 REGEX = str
+MATCH_CACHE_SIZE = 1 << 16
 
 
 class Mapping:
@@ -15,6 +20,8 @@ class Mapping:
     """
     mapping: Dict[REGEX, SyncNodeRole]
     baked_mapping: List[Tuple[Pattern[AnyStr], SyncNodeRole]]
+    combined: Optional[Pattern[AnyStr]]
+    combined_roles: Dict[str, SyncNodeRole]
 
     def __init__(self, mapping: Dict[REGEX, SyncNodeRole]) -> None:
         super().__init__()
@@ -22,13 +29,19 @@ class Mapping:
         self.baked_mapping = [
             (re.compile(k), v) for (k, v) in mapping.items()
         ]
+        self.combined, self.combined_roles = combine_patterns(mapping)
+        self.match = lru_cache(maxsize=MATCH_CACHE_SIZE)(self.match)
 
     def match(self, path: str) -> Optional[SyncNodeRole]:
         """
-        Matches given path with specified role mapping
+        Matches given path with specified role mapping. The first matching pattern wins
         :param path:
         :return:
         """
+        if self.combined is not None:
+            m = self.combined.match(path)
+            return self.combined_roles[m.lastgroup] if m else None
+
         for (rep, role) in self.baked_mapping:
             if rep.match(path):
                 return role
@@ -38,6 +51,27 @@ class Mapping:
         return set(self.mapping.values())
 
 
+def combine_patterns(mapping: Dict[REGEX, SyncNodeRole]) -> Tuple[Optional[Pattern[AnyStr]], Dict[str, SyncNodeRole]]:
+    """
+    Compiles all the patterns into a single alternation with a named group per pattern. Alternatives are tried in
+    order, so the first matching pattern still wins
+    :param mapping:
+    :return: the combined pattern and the roles by group name. No pattern if the patterns can not be combined
+    """
+    # Numbered backreferences would point to the wrong groups once the patterns are wrapped
+    if not mapping or any(re.search(r'\\[1-9]', k) for k in mapping):
+        return None, {}
+
+    roles = {f'_r{i}': role for i, role in enumerate(mapping.values())}
+    try:
+        combined = re.compile('|'.join(f'(?P<_r{i}>{k})' for i, k in enumerate(mapping.keys())))
+    except re.error as e:
+        # E.g. duplicate group names or inline flags which only apply at the start of a pattern
+        logging.debug(f'Matching the mapping patterns one by one: {e}')
+        return None, {}
+    return combined, roles
+
+
 class ResourceAction(Enum):
     CREATE = 'create'
     UPDATE = 'update'
@@ -56,6 +90,21 @@ class NotionResourceMapper:
             raise Exception(f'Notion Resource Mapper is missing: {resource_action.value}_{resource}')
         return method(action)
 
+    def estimate(self, resource_action: ResourceAction, resource: SyncNodeRole, action: SyncAction) -> \
+            Optional['SyncEstimate']:
+        """
+        Estimates the cost of executing the resource action through the matching estimate_action_resource function
+        :param resource_action:
+        :param resource:
+        :param action:
+        :return: the estimate or None if the mapper can not estimate the action
+        """
+        method = getattr(self, f'estimate_{resource_action.value}_{resource}', None)
+        if method is None:
+            logging.debug(f'Notion Resource Mapper can not estimate: {resource_action.value}_{resource}')
+            return None
+        return method(action)
+
 
 @dataclass
 class SyncConfig:
@@ -66,10 +115,14 @@ class SyncConfig:
     structure_types: Dict[SyncNodeRole, SyncNodeType]
     hierarchy: List[str]
     resource_mapper: NotionResourceMapper
+    rate_limiter: Optional[RateLimiter] = None
 
-    def data(self) -> SyncData:
-        return SyncData(
+    def data(self, backend: Optional[StateBackend] = None) -> SyncData:
+        data = SyncData(
             SyncTree.create_notion(self.notion_root),
             SyncTree.create_local(),
             self.root_dir
         )
+        if backend is not None:
+            data.backend = backend
+        return data
@@ -1,5 +1,6 @@
 import logging
-from typing import Optional, List, Dict, Union
+from collections import defaultdict, deque
+from typing import Optional, List, Dict, Union, Deque, Hashable, Iterable
 
 from notionsy.sync_tree import SyncMetadataNotion, SyncMetadataLocal, SyncMetadata, SyncNodeRole, \
     SyncNode, SyncTree
@@ -39,12 +40,10 @@ class SyncMerger:
         logging.debug(f'Merging children for node_role: {root_role}')
         # TODO: restrict to nodes which are not separated by a roleassigned node within the path
         match_role = lambda item: item.node_role == root_role
-        lchildren: Dict[str, SyncNode] = {k: v for (k, v) in enumerate(tl.flatten(match_role))}
-        rchildren: Dict[str, SyncNode] = {k: v for (k, v) in enumerate(tr.flatten(match_role))}
-        for k, lc in lchildren.items():
-            rck = next(filter(lambda k: self.match_nodes(lc, rchildren[k]), rchildren.keys()), None)
-            if rck is not None:
-                rc = rchildren.pop(rck)
+        rchildren = SyncNodeIndex(tr.flatten(match_role))
+        for lc in tl.flatten(match_role):
+            rc = rchildren.pop_match(lc)
+            if rc is not None:
                 lc = self.merge_nodes(hierarchy, lc, rc, res)  # TODO implement
             else:
                 lc = self.merge_branch(hierarchy, lc, res)
@@ -52,7 +51,7 @@ class SyncMerger:
             res.children.append(lc)
 
         # Add remaining children from the rhs
-        for rc in rchildren.values():
+        for rc in rchildren.remaining():
             res.children.append(self.merge_branch(hierarchy, rc, res))
 
         return res
@@ -91,7 +90,7 @@ class SyncMerger:
             return True
 
         def fuzzy_match(ml: SyncMetadataLocal, mr: SyncMetadataNotion):
-            return ml.path.replace('.md', '') == mr.title
+            return fuzzy_title(ml) == mr.title
 
         if nl.metadata_local and not nr.metadata_local and nr.metadata_notion and not nl.metadata_notion:
             return fuzzy_match(nl.metadata_local, nr.metadata_notion)
@@ -114,3 +113,79 @@ class SyncMerger:
             return mr if ml is None else mr
 
         return mr if mr.updated_at > ml.updated_at else ml
+
+
+def fuzzy_title(metadata: SyncMetadataLocal) -> str:
+    """
+    Normalizes a local filename to the title the node would have in notion
+    :param metadata:
+    :return:
+    """
+    return metadata.path.replace('.md', '')
+
+
+class SyncNodeIndex:
+    """
+    Lookup indexes over a list of candidate nodes for SyncMerger.match_nodes. Resolves the first remaining
+    candidate (in list order) matching a node in constant time instead of scanning all the candidates
+    """
+    nodes: List[SyncNode]
+    taken: List[bool]
+
+    def __init__(self, nodes: List[SyncNode]) -> None:
+        super().__init__()
+        self.nodes = nodes
+        self.taken = [False] * len(nodes)
+        self.by_id = self.build(lambda n: n.id)
+        self.by_path = self.build(lambda n: n.metadata_local.path if n.metadata_local else None)
+        self.by_notion_id = self.build(lambda n: n.metadata_notion.id if n.metadata_notion else None)
+        # Candidates only known on one side are matched by title / filename
+        self.by_title = self.build(
+            lambda n: n.metadata_notion.title if n.metadata_notion and not n.metadata_local else None
+        )
+        self.by_filename = self.build(
+            lambda n: fuzzy_title(n.metadata_local) if n.metadata_local and not n.metadata_notion else None
+        )
+
+    def build(self, key_fn) -> Dict[Hashable, Deque[int]]:
+        index = defaultdict(deque)
+        for (k, node) in enumerate(self.nodes):
+            key = key_fn(node)
+            if key is not None:
+                index[key].append(k)
+        return index
+
+    def candidates(self, node: SyncNode) -> Iterable[Deque[int]]:
+        yield self.by_id.get(node.id)
+        if node.metadata_local:
+            yield self.by_path.get(node.metadata_local.path)
+        if node.metadata_notion:
+            yield self.by_notion_id.get(node.metadata_notion.id)
+        if node.metadata_local and not node.metadata_notion:
+            yield self.by_title.get(fuzzy_title(node.metadata_local))
+        if node.metadata_notion and not node.metadata_local:
+            yield self.by_filename.get(node.metadata_notion.title)
+
+    def pop_match(self, node: SyncNode) -> Optional[SyncNode]:
+        """
+        Removes and returns the first remaining candidate matching the given node
+        :param node:
+        :return:
+        """
+        best = None
+        for bucket in self.candidates(node):
+            if not bucket:
+                continue
+            # Lazily drop candidates which were already matched
+            while bucket and self.taken[bucket[0]]:
+                bucket.popleft()
+            if bucket and (best is None or bucket[0] < best):
+                best = bucket[0]
+
+        if best is None:
+            return None
+        self.taken[best] = True
+        return self.nodes[best]
+
+    def remaining(self) -> List[SyncNode]:
+        return [node for (k, node) in enumerate(self.nodes) if not self.taken[k]]
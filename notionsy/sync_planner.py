@@ -5,15 +5,18 @@ from enum import Enum
 from functools import partial
 from itertools import chain
 from operator import is_not
-from typing import List, Optional
+from typing import List, Optional, Iterable, Iterator, Callable, Any, Dict
 
 from notionsy.sync_tree import SyncNode, SyncNodeType
+from notionsy.utils.merge import MergeBase, merge3, normalize_lines
 
 
 class SyncActionType(Enum):
     FETCH = 'FETCH'
     DELETE = 'DELETE'
     CONFLICT = 'CONFLICT'
+    # Writes the merged content of concurrent edits to both sides
+    MERGE = 'MERGE'
 
 
 class SyncActionTarget(Enum):
@@ -59,6 +62,13 @@ class SyncAction:
             else node.metadata_notion.updated_at
         )
 
+    @staticmethod
+    def merge(node: SyncNode, content: str, actions: List['SyncAction']) -> 'SyncAction':
+        return SyncAction(
+            SyncActionType.MERGE, SyncActionTarget.LOCAL,
+            node, max(*map(lambda x: x.changed_at, actions)), content=content
+        )
+
     @staticmethod
     def conflict(node: SyncNode, actions: List['SyncAction']) -> 'SyncAction':
         return SyncAction(
@@ -76,12 +86,55 @@ class SyncAction:
             return SyncAction.fetch(action_target, node)
 
 
+# Sort key of sibling nodes. Children are always planned after their parent, whatever the order of the siblings
+OrderingPolicy = Callable[[SyncNode], Any]
+
+
+def structure_first(node: SyncNode) -> Any:
+    """
+    Plans groups before the notes next to them, so the structure is created before the content
+    """
+    return node.node_type != SyncNodeType.GROUP
+
+
+def recent_first(node: SyncNode) -> Any:
+    """
+    Plans the most recently changed nodes first
+    """
+    changes = [m.updated_at for m in (node.metadata_local, node.metadata_notion) if m is not None]
+    return -max(changes).timestamp() if changes else 0
+
+
+ORDERING_POLICIES: Dict[str, Optional[OrderingPolicy]] = {
+    'tree': None,
+    'structure': structure_first,
+    'recent': recent_first,
+}
+
+
+@dataclass
 class SyncPlanner:
+    policy: Optional[OrderingPolicy] = None
+
     def plan(self, node: SyncNode) -> List[SyncAction]:
-        return [
-            *self.plan_node(node),
-            *chain(*map(self.plan, node.children))
-        ]
+        return list(self.iter_plan(node))
+
+    def iter_plan(self, node: SyncNode) -> Iterator[SyncAction]:
+        """
+        Walks the tree iteratively and yields the actions of every node before the actions of its children.
+        Siblings are walked in tree order or in the order of the policy
+        :param node:
+        :return:
+        """
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield from self.plan_node(node)
+
+            children = node.child_nodes
+            if self.policy is not None and len(children) > 1:
+                children = sorted(children, key=self.policy)
+            stack.extend(reversed(children))
 
     def plan_node(self, node: SyncNode) -> List[SyncAction]:
         # Skip nodes nto corresponding to any concrete data
@@ -103,9 +156,27 @@ class SyncPlanner:
         return list(filter(partial(is_not, None), [local_change, notion_change]))
 
 
+# Resolutions of conflicting note edits which can not be merged
+CONFLICT_POLICIES = ['prompt', 'local', 'notion', 'skip']
+
+
+@dataclass
 class SyncConflictResolver:
-    def resolve(self, items: List[SyncAction]) -> List[SyncAction]:
-        return list(chain(*map(self.resolve_conflict, items)))
+    """
+    Resolves the conflicting changes of both sides. Concurrent edits of a note are merged line by line against the
+    last synced content if a merge base and a way to fetch the contents are given. Remaining conflicts are resolved
+    by the policy
+    """
+    policy: str = 'prompt'
+    merge_base: Optional[MergeBase] = None
+    # Reads the content of the given fetch action into it
+    fetch: Optional[Callable[[SyncAction], None]] = None
+
+    def resolve(self, items: Iterable[SyncAction]) -> List[SyncAction]:
+        return list(self.iter_resolve(items))
+
+    def iter_resolve(self, items: Iterable[SyncAction]) -> Iterator[SyncAction]:
+        return chain.from_iterable(map(self.resolve_conflict, items))
 
     def resolve_conflict(self, action: SyncAction) -> List[SyncAction]:
         if action.action_type != SyncActionType.CONFLICT:
@@ -115,17 +186,52 @@ class SyncConflictResolver:
             logging.info(f'Automatically resolving conflict: \n\t{action}\nReason: Structural Content')
             return action.conflicts
 
-        print(f'Conflict occurred: \n{str(action)}\n')
-        while True:
+        merged = self.merge(action)
+        if merged is not None:
+            logging.info(f'Automatically resolving conflict: \n\t{action}\nReason: Merged Content')
+            return [SyncAction.merge(action.node, merged, action.conflicts)]
+
+        return self.apply_policy(action)
+
+    def merge(self, action: SyncAction) -> Optional[str]:
+        """
+        Merges the conflicting contents of a note against its merge base
+        :param action: conflict of a note
+        :return: the merged content, None if the changes overlap or can not be merged
+        """
+        if self.fetch is None or self.merge_base is None:
+            return None
+
+        local, notion = sorted(action.conflicts, key=lambda a: a.action_target != SyncActionTarget.LOCAL)
+        try:
+            self.fetch(local)
+            self.fetch(notion)
+        except Exception as e:
+            logging.warning(f'Could not fetch the conflicting contents to merge: {e}')
+            return None
+
+        # The notion export differs from the uploaded markdown in layout only
+        if normalize_lines(local.content) == normalize_lines(notion.content):
+            return local.content
+        base = self.merge_base.get(str(action.node.id))
+        if base is None:
+            return None
+        return merge3(base, local.content, notion.content)
+
+    def apply_policy(self, action: SyncAction) -> List[SyncAction]:
+        choice = self.policy[0] if self.policy != 'prompt' else None
+        if choice is None:
+            print(f'Conflict occurred: \n{str(action)}\n')
+        while choice is None:
             choice = input('Would you like to prefer [l]ocal changes, [n]otion changes, [s]kip or [a]bort sync:')
-            if choice not in 'lnas':
-                continue
-
-            if choice == 'l':
-                return list(filter(lambda a: a.action_target == SyncActionTarget.LOCAL, action.conflicts))
-            elif choice == 'n':
-                return list(filter(lambda a: a.action_target == SyncActionTarget.NOTION, action.conflicts))
-            elif choice == 's':
-                return []
-            elif choice == 'a':
-                exit(0)
+            if choice not in ['l', 'n', 'a', 's']:
+                choice = None
+
+        if choice == 'l':
+            return list(filter(lambda a: a.action_target == SyncActionTarget.LOCAL, action.conflicts))
+        elif choice == 'n':
+            return list(filter(lambda a: a.action_target == SyncActionTarget.NOTION, action.conflicts))
+        elif choice == 's':
+            return []
+        elif choice == 'a':
+            exit(0)
@@ -0,0 +1,124 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Set
+
+from notion.client import NotionClient
+from notion.space import Space
+from notion.utils import extract_id, InvalidNotionIdentifier
+
+from notionsy.sync_tree import Path
+
+
+@dataclass
+class SyncRoot:
+    """
+    Pair of a notion page and a local directory synced with each other
+    """
+    notion_path: str
+    local_path: Path
+    # Ids of the notion page and the records above it, once resolved by resolve_ancestors
+    notion_ancestors: Set[str] = field(default_factory=set, compare=False, repr=False)
+
+    @property
+    def notion_id(self) -> str:
+        try:
+            return extract_id(self.notion_path)
+        except InvalidNotionIdentifier:
+            return self.notion_path
+
+    def overlaps(self, other: 'SyncRoot') -> bool:
+        """
+        Whether the roots can not be synced concurrently, since they sync the same or nested notion pages or nested
+        directories. Nested notion pages are only detected once the ancestors of the roots are resolved
+        :param other:
+        :return:
+        """
+        if self.notion_id == other.notion_id:
+            return True
+        if self.notion_id in other.notion_ancestors or other.notion_id in self.notion_ancestors:
+            return True
+        paths = [os.path.realpath(self.local_path), os.path.realpath(other.local_path)]
+        return os.path.commonpath(paths) in paths
+
+    def __str__(self) -> str:
+        return f'{self.notion_path} <-> {self.local_path}'
+
+
+def sync_roots(notion_path: Optional[str], local_path: Optional[Path], roots: List[SyncRoot]) -> List[SyncRoot]:
+    """
+    Lists the roots to sync: the single notion_path and local_path pair, if given, followed by the configured roots
+    :param notion_path:
+    :param local_path:
+    :param roots:
+    :return:
+    """
+    result = [SyncRoot(notion_path, local_path)] if notion_path and local_path else []
+    for root in roots:
+        if root not in result:
+            result.append(root)
+    return result
+
+
+def resolve_ancestors(client: NotionClient, roots: List[SyncRoot]):
+    """
+    Resolves the notion ancestors of every root, so roots of nested notion pages overlap. The pages are fetched
+    through the shared client, so their records are at hand once the roots are synced. A root whose page can not be
+    fetched keeps no ancestors and fails once it is synced
+    :param client:
+    :param roots:
+    :return:
+    """
+    for root in roots:
+        ancestors = set()
+        try:
+            record = client.get_block(root.notion_id)
+            while record is not None and not isinstance(record, Space) and record.id not in ancestors:
+                ancestors.add(record.id)
+                record = record.parent
+        except Exception as e:
+            logging.warning(f'Could not resolve the notion ancestors of {root}: {e}')
+        root.notion_ancestors = ancestors
+
+
+def root_groups(roots: List[SyncRoot]) -> List[List[SyncRoot]]:
+    """
+    Groups the roots which transitively overlap. Roots of a group keep their configured order
+    :param roots:
+    :return: groups which can be synced concurrently
+    """
+    groups: List[List[int]] = []
+    for i, root in enumerate(roots):
+        joined = [group for group in groups if any(root.overlaps(roots[j]) for j in group)]
+        groups = [group for group in groups if group not in joined]
+        groups.append(sorted([j for group in joined for j in group] + [i]))
+    return [[roots[i] for i in group] for group in sorted(groups)]
+
+
+def run_roots(roots: List[SyncRoot], fn: Callable[[SyncRoot], None], workers: int = 1) -> List[SyncRoot]:
+    """
+    Runs the given function for every root. Groups of overlapping roots run one root after the other, while
+    independent groups run on a pool of workers. A failing root does not stop the others
+    :param roots:
+    :param fn:
+    :param workers: number of groups run concurrently
+    :return: the roots which failed
+    """
+    def run_group(group: List[SyncRoot]) -> List[SyncRoot]:
+        failed = []
+        for root in group:
+            logging.info(f'Syncing {root}')
+            try:
+                fn(root)
+            except Exception as e:
+                logging.exception(f'Failed to sync {root}: {e}')
+                failed.append(root)
+        return failed
+
+    groups = root_groups(roots)
+    if workers <= 1 or len(groups) <= 1:
+        return [root for group in groups for root in run_group(group)]
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='notionsy-root') as executor:
+        return [root for failed in executor.map(run_group, groups) for root in failed]
@@ -0,0 +1,320 @@
+import logging
+import os
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, Tuple, Dict, List, Any, Type
+
+import yaml
+
+from notionsy.sync_tree import SyncTree, SyncNode, SyncNodeType, SyncMetadataNotion, SyncMetadataLocal, Path, \
+    TREE_FILENAME, STATE_FILENAME
+from notionsy.utils.serialization import SecretYamlObject, json_dumps, json_loads, atomic_open
+
+STATE_FORMAT = 'notionsy-state'
+STATE_VERSION = 1
+TREE_NAMES = ['notion_tree', 'local_tree']
+NODE_TYPES = {node_type.value: node_type for node_type in SyncNodeType}
+
+Record = Dict[str, Any]
+
+
+class StateBackend(ABC):
+    """
+    Storage format for the sync trees
+    """
+    filename: str
+
+    def path(self, root_dir: Path) -> Path:
+        return os.path.join(root_dir, self.filename)
+
+    def exists(self, root_dir: Path) -> bool:
+        return os.path.exists(self.path(root_dir))
+
+    @abstractmethod
+    def read(self, root_dir: Path) -> Tuple[SyncTree, SyncTree]:
+        """
+        Reads the notion and local tree with all the parent references restored
+        :param root_dir:
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def write(self, root_dir: Path, data: 'SyncData'):
+        pass
+
+
+class YamlStateBackend(StateBackend):
+    """
+    Legacy backend storing the whole SyncData object as tagged yaml
+    """
+    filename = TREE_FILENAME
+
+    def read(self, root_dir: Path) -> Tuple[SyncTree, SyncTree]:
+        with open(self.path(root_dir), 'r') as f:
+            data: SyncData = yaml.load(f, Loader=yaml.Loader)
+
+        # Fill parent fields which are not serialized
+        for tree in [data.notion_tree, data.local_tree]:
+            stack: List[Tuple[Optional[SyncNode], SyncNode]] = [(None, tree)]
+            while stack:
+                parent, node = stack.pop()
+                node.parent = parent
+                stack.extend((node, child) for child in reversed(node.child_nodes))
+
+        return data.notion_tree, data.local_tree
+
+    def write(self, root_dir: Path, data: 'SyncData'):
+        with atomic_open(self.path(root_dir), 'w') as f:
+            yaml.dump(data, f, default_flow_style=False)
+
+
+class JsonLinesStateBackend(StateBackend):
+    """
+    Compact backend storing one json record per node in pre-order. Every record references the index of its
+    parent record, so the parent links are restored while reading. Nodes and metadata shared between
+    parents or trees are stored once and referenced afterwards
+    """
+    filename = STATE_FILENAME
+
+    def read(self, root_dir: Path) -> Tuple[SyncTree, SyncTree]:
+        decoder = StateDecoder()
+        trees: Dict[str, SyncTree] = {}
+        with open(self.path(root_dir), 'rb') as f:
+            header = json_loads(f.readline())
+            if header.get('format') != STATE_FORMAT or header.get('version') != STATE_VERSION:
+                raise ValueError(f'Unsupported sync state format: {header}')
+
+            for line in f:
+                node = decoder.node(json_loads(line))
+                if isinstance(node, SyncTree) and node.parent is None:
+                    trees[decoder.tree_name] = node
+
+        return trees['notion_tree'], trees['local_tree']
+
+    def write(self, root_dir: Path, data: 'SyncData'):
+        encoder = StateEncoder()
+        with atomic_open(self.path(root_dir), 'wb') as f:
+            f.write(json_dumps({'format': STATE_FORMAT, 'version': STATE_VERSION, 'trees': TREE_NAMES}))
+            f.write(b'\n')
+            for name in TREE_NAMES:
+                for record in encoder.tree(name, getattr(data, name)):
+                    f.write(json_dumps(record))
+                    f.write(b'\n')
+
+
+STATE_BACKENDS: Dict[str, Type[StateBackend]] = {
+    'jsonl': JsonLinesStateBackend,
+    'yaml': YamlStateBackend,
+}
+
+
+@dataclass
+class SyncData(SecretYamlObject):
+    """
+    Data object storing all the necessary data for sync
+    """
+    hidden_fields = ['backend']
+    yaml_tag = u'!SyncData'
+
+    notion_tree: SyncTree
+    local_tree: SyncTree
+    root_dir: Path
+    backend: StateBackend = field(default_factory=JsonLinesStateBackend)
+
+    def write(self):
+        path = self.backend.path(self.root_dir)
+        logging.debug(f'Flushing SyncTree to: {path}')
+        self.backend.write(self.root_dir, self)
+
+        # Retire the state files of other formats so they are never read instead of the fresh state
+        for backend_cls in STATE_BACKENDS.values():
+            backend = backend_cls()
+            if backend.filename != self.backend.filename and backend.exists(self.root_dir):
+                logging.info(f'Migrated SyncTree from {backend.path(self.root_dir)} to {path}')
+                os.replace(backend.path(self.root_dir), f'{backend.path(self.root_dir)}.bak')
+
+    def read(self):
+        backends = [self.backend, *(
+            backend_cls() for backend_cls in STATE_BACKENDS.values() if not isinstance(self.backend, backend_cls)
+        )]
+        backend = next(filter(lambda b: b.exists(self.root_dir), backends), None)
+        if backend is None:
+            logging.debug(f'No SyncTree found at: {self.backend.path(self.root_dir)}')
+            return
+
+        logging.debug(f'Loading SyncTree from: {backend.path(self.root_dir)}')
+        self.notion_tree, self.local_tree = backend.read(self.root_dir)
+
+    def apply(self, tree: SyncTree):
+        nodes = {n.id: n for n in tree.flatten()}
+
+        for t in [self.notion_tree, self.local_tree]:
+            for node in t.traverse():
+                ref: SyncNode = nodes.get(node.id)
+                if ref is None: continue
+                node.metadata_notion = ref.metadata_notion
+                node.metadata_local = ref.metadata_local
+                node.synced_at = ref.synced_at
+
+
+class StateEncoder:
+    """
+    Encodes nodes into json records. Remembers the written nodes and metadata to reference them
+    when they are encountered again
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.nodes: Dict[int, int] = {}
+        self.metadata: Dict[int, int] = {}
+
+    def tree(self, name: str, tree: SyncTree):
+        root = self.node(tree, None)
+        root.update(
+            tree=name,
+            notion_synced_at=encode_dt(tree.notion_synced_at),
+            local_synced_at=encode_dt(tree.local_synced_at),
+        )
+        yield root
+
+        stack = [(self.nodes[id(tree)], child) for child in reversed(tree.child_nodes)]
+        while stack:
+            parent, node = stack.pop()
+            if id(node) in self.nodes:
+                yield {'p': parent, 'ref': self.nodes[id(node)]}
+                continue
+
+            yield self.node(node, parent)
+            stack.extend((self.nodes[id(node)], child) for child in reversed(node.child_nodes))
+
+    def node(self, node: SyncNode, parent: Optional[int]) -> Record:
+        self.nodes[id(node)] = len(self.nodes)
+        return {
+            'p': parent,
+            'id': str(node.id),
+            'type': node.node_type.value,
+            'role': node.node_role,
+            'synced_at': encode_dt(node.synced_at),
+            'notion': self.metadata_notion(node.metadata_notion),
+            'local': self.metadata_local(node.metadata_local),
+        }
+
+    def reference(self, metadata: Any) -> Optional[Record]:
+        if id(metadata) in self.metadata:
+            return {'ref': self.metadata[id(metadata)]}
+        self.metadata[id(metadata)] = len(self.metadata)
+        return None
+
+    def metadata_notion(self, metadata: Optional[SyncMetadataNotion]) -> Optional[Record]:
+        if metadata is None:
+            return None
+        return self.reference(metadata) or encode_metadata_notion(metadata)
+
+    def metadata_local(self, metadata: Optional[SyncMetadataLocal]) -> Optional[Record]:
+        if metadata is None:
+            return None
+        return self.reference(metadata) or encode_metadata_local(metadata)
+
+
+class StateDecoder:
+    """
+    Decodes the records written by StateEncoder in order
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.nodes: List[SyncNode] = []
+        self.metadata: List[Any] = []
+        self.tree_name: Optional[str] = None
+
+    def node(self, record: Record) -> SyncNode:
+        parent = self.nodes[record['p']] if record['p'] is not None else None
+        if 'ref' in record:
+            node = self.nodes[record['ref']]
+            node.parent = parent
+            parent.children.append(node)
+            return node
+
+        kwargs = dict(
+            id=uuid.UUID(record['id']),
+            parent=parent,
+            node_type=NODE_TYPES[record['type']],
+            node_role=record['role'],
+            metadata_notion=self.metadata_notion(record['notion']),
+            metadata_local=self.metadata_local(record['local']),
+            synced_at=decode_dt(record['synced_at']),
+        )
+        if parent is None:
+            self.tree_name = record['tree']
+            node = SyncTree(
+                notion_synced_at=decode_dt(record['notion_synced_at']),
+                local_synced_at=decode_dt(record['local_synced_at']),
+                **kwargs
+            )
+        else:
+            node = SyncNode(**kwargs)
+            parent.children.append(node)
+
+        self.nodes.append(node)
+        return node
+
+    def metadata_notion(self, record: Optional[Record]) -> Optional[SyncMetadataNotion]:
+        if record is None:
+            return None
+        if 'ref' in record:
+            return self.metadata[record['ref']]
+        metadata = decode_metadata_notion(record)
+        self.metadata.append(metadata)
+        return metadata
+
+    def metadata_local(self, record: Optional[Record]) -> Optional[SyncMetadataLocal]:
+        if record is None:
+            return None
+        if 'ref' in record:
+            return self.metadata[record['ref']]
+        metadata = decode_metadata_local(record)
+        self.metadata.append(metadata)
+        return metadata
+
+
+def encode_metadata_notion(metadata: SyncMetadataNotion) -> Record:
+    return {
+        'id': metadata.id,
+        'title': metadata.title,
+        'updated_at': encode_dt(metadata.updated_at),
+        'deleted': metadata.deleted,
+        'relations': dict(metadata.relations),
+    }
+
+
+def decode_metadata_notion(record: Record) -> SyncMetadataNotion:
+    return SyncMetadataNotion(
+        record['id'], record['title'], decode_dt(record['updated_at']), record['deleted'], record['relations']
+    )
+
+
+def encode_metadata_local(metadata: SyncMetadataLocal) -> Record:
+    return {
+        'path': metadata.path,
+        'updated_at': encode_dt(metadata.updated_at),
+        'deleted': metadata.deleted,
+        'digest': metadata.digest,
+        'synced_digest': metadata.synced_digest,
+    }
+
+
+def decode_metadata_local(record: Record) -> SyncMetadataLocal:
+    return SyncMetadataLocal(
+        record['path'], decode_dt(record['updated_at']), record['deleted'], record['digest'], record['synced_digest']
+    )
+
+
+def encode_dt(dt: Optional[datetime]) -> Optional[str]:
+    return dt.isoformat() if dt else None
+
+
+def decode_dt(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
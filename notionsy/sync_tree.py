@@ -1,22 +1,61 @@
 import itertools
-import logging
 import os
+import reprlib
+import sys
 import uuid
-from dataclasses import dataclass, field
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
-from typing import Optional, Union, List, Dict, Tuple, Callable, Iterable
+from types import MappingProxyType
+from typing import Optional, Union, List, Dict, Tuple, Callable, Iterable, Any, Mapping, Sequence
 from uuid import UUID
 
 import yaml
 
+from notionsy.utils.block_cache import BLOCK_CACHE_FILENAME
+from notionsy.utils.hash_cache import HASH_CACHE_FILENAME
+from notionsy.utils.merge import MERGE_BASE_DIRNAME
+from notionsy.utils.snapshot import SNAPSHOTS_DIRNAME
 from notionsy.utils.serialization import SecretYamlObject
 
 SyncNodeRole = str
 GUID = str
 Path = str
 TREE_FILENAME = '.sync.yml'
-INTERNAL_FILES = [TREE_FILENAME, 'resources', 'config.yml']
+STATE_FILENAME = '.sync.jsonl'
+JOURNAL_FILENAME = '.sync.journal'
+INTERNAL_FILES = [
+    TREE_FILENAME, STATE_FILENAME, JOURNAL_FILENAME, HASH_CACHE_FILENAME, BLOCK_CACHE_FILENAME, MERGE_BASE_DIRNAME,
+    SNAPSHOTS_DIRNAME, 'resources', 'config.yml'
+]
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+EMPTY_RELATIONS: Mapping[SyncNodeRole, List[GUID]] = MappingProxyType({})
+
+# Naive datetimes are stored as microseconds since the epoch, which takes less memory than a datetime object
+CompactDatetime = Union[int, datetime]
+
+
+def compact_dt(dt: Optional[datetime]) -> Optional[CompactDatetime]:
+    if dt is None or dt.tzinfo is not None:
+        return dt
+    return (dt - EPOCH) // MICROSECOND
+
+
+def expand_dt(value: Optional[CompactDatetime]) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    return EPOCH + timedelta(microseconds=value)
+
+
+def is_before(a: CompactDatetime, b: CompactDatetime) -> bool:
+    if type(a) is int and type(b) is int:
+        return a < b
+    return expand_dt(a) < expand_dt(b)
+
+
+def default_updated_at() -> datetime:
+    return datetime.now().replace(year=1990)
 
 
 class SyncNodeType(Enum):
@@ -47,31 +86,112 @@ yaml.add_representer(SyncNodeType, enum_representer('!SyncNodeType'))
 yaml.add_constructor('!SyncNodeType', enum_deserailize(SyncNodeType))
 
 
-@dataclass
-class SyncMetadataNotion(yaml.YAMLObject):
+class SyncStruct:
+    """
+    Base of the slotted sync structs. Provides the comparison, representation and (yaml) state of the public
+    fields, with the datetime and uuid values expanded from their compact storage
+    """
+    __slots__ = ()
+    fields: Tuple[str, ...] = ()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.fields}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__init__(**{name: value for name, value in state.items() if name in self.fields})
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.fields)
+
+    @reprlib.recursive_repr()
+    def __repr__(self) -> str:
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.fields)
+        return f'{self.__class__.__qualname__}({values})'
+
+
+class SyncMetadataNotion(SyncStruct, yaml.YAMLObject):
     """
     Struct responsible for storing the required metadata for notion provider
     """
+    __slots__ = ('id', 'title', '_updated_at', 'deleted', '_relations')
     yaml_tag = u'!SyncMetadataNotion'
-    id: GUID
-    title: str
-    updated_at: datetime = field(default_factory=lambda: datetime.now().replace(year=1990))
-    deleted: bool = False
-    relations: Dict[SyncNodeRole, List[GUID]] = field(default_factory=lambda: {})
+    fields = ('id', 'title', 'updated_at', 'deleted', 'relations')
+
+    def __init__(
+            self, id: GUID, title: str, updated_at: Optional[datetime] = None, deleted: bool = False,
+            relations: Optional[Dict[SyncNodeRole, List[GUID]]] = None
+    ) -> None:
+        self.id = id
+        self.title = title
+        self.updated_at = updated_at if updated_at is not None else default_updated_at()
+        self.deleted = deleted
+        self.relations = relations
+
+    @property
+    def updated_at(self) -> datetime:
+        return expand_dt(self._updated_at)
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        self._updated_at = compact_dt(value)
+
+    @property
+    def relations(self) -> Mapping[SyncNodeRole, List[GUID]]:
+        """
+        Related notion ids by role. Most items have no relations, these share a read-only empty mapping, so the
+        relations are changed by assigning them
+        :return:
+        """
+        return self._relations if self._relations is not None else EMPTY_RELATIONS
+
+    @relations.setter
+    def relations(self, value: Optional[Mapping[SyncNodeRole, List[GUID]]]):
+        self._relations = {sys.intern(role): ids for role, ids in value.items()} if value else None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = super().__getstate__()
+        state['relations'] = dict(self.relations)
+        return state
 
     def __str__(self) -> str:
         return f'{self.title}\n\t{self.updated_at.strftime("%Y-%m-%d %H:%M")}|{self.deleted}'
 
 
-@dataclass
-class SyncMetadataLocal(yaml.YAMLObject):
+class SyncMetadataLocal(SyncStruct, yaml.YAMLObject):
     """
-    Struct responsible for storing the required metadata for local provider
+    Struct responsible for storing the required metadata for local provider. Metadata is shared between the trees,
+    so nodes are renamed by assigning new metadata, which moves the cached paths of the nodes below
     """
+    __slots__ = ('path', '_updated_at', 'deleted', 'digest', 'synced_digest')
     yaml_tag = u'!SyncMetadataLocal'
-    path: Path
-    updated_at: datetime = field(default_factory=lambda: datetime.now().replace(year=1990))
-    deleted: bool = False
+    fields = ('path', 'updated_at', 'deleted', 'digest', 'synced_digest')
+
+    def __init__(
+            self, path: Path, updated_at: Optional[datetime] = None, deleted: bool = False,
+            digest: Optional[str] = None, synced_digest: Optional[str] = None
+    ) -> None:
+        self.path = path
+        self.updated_at = updated_at if updated_at is not None else default_updated_at()
+        self.deleted = deleted
+        self.digest = digest
+        self.synced_digest = synced_digest
+
+    @property
+    def updated_at(self) -> datetime:
+        return expand_dt(self._updated_at)
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        self._updated_at = compact_dt(value)
+
+    def content_changed(self) -> bool:
+        """
+        Whether the content differs from the last synced content. Without digests every change is assumed real
+        :return:
+        """
+        return self.digest is None or self.digest != self.synced_digest
 
     def __str__(self) -> str:
         return f'{self.path}\n\t{self.updated_at.strftime("%Y-%m-%d %H:%M")}|{self.deleted}'
@@ -80,22 +200,93 @@ class SyncMetadataLocal(yaml.YAMLObject):
 SyncMetadata = Union[SyncMetadataNotion, SyncMetadataLocal]
 
 
-@dataclass
-class SyncNode(SecretYamlObject):
+class SyncNode(SyncStruct, SecretYamlObject):
     """
     General node struct toring data about a sync node which may be a directory/group or a file
     """
+    __slots__ = (
+        'id', '_parent', '_children', 'node_type', 'node_role', 'metadata_notion', '_metadata_local', '_synced_at',
+        '_local_dir'
+    )
     hidden_fields = ["parent"]
     yaml_tag = u'!SyncNode'
+    fields = ('id', 'parent', 'children', 'node_type', 'node_role', 'metadata_notion', 'metadata_local', 'synced_at')
+
+    def __init__(
+            self, id: Optional[UUID] = None, parent: Optional[Union['SyncNode', 'SyncTree']] = None,
+            children: Optional[List['SyncNode']] = None, node_type: SyncNodeType = SyncNodeType.UNKNOWN,
+            node_role: Optional[SyncNodeRole] = None, metadata_notion: Optional[SyncMetadataNotion] = None,
+            metadata_local: Optional[SyncMetadataLocal] = None, synced_at: Optional[datetime] = None
+    ) -> None:
+        self.id = id if id is not None else uuid.uuid4()
+        self._local_dir: Optional[Path] = None
+        self._parent = parent
+        self._children = children or None
+        if parent is not None:
+            self.invalidate_path_index()
+        self.node_type = node_type
+        # Roles repeat for every node, interned they are stored once. Roles assigned later come from the mappings
+        self.node_role = sys.intern(node_role) if node_role is not None else None
+        self.metadata_notion = metadata_notion
+        self._metadata_local = metadata_local
+        self.synced_at = synced_at
+
+    @property
+    def parent(self) -> Optional[Union['SyncNode', 'SyncTree']]:
+        return self._parent
+
+    @parent.setter
+    def parent(self, value: Optional[Union['SyncNode', 'SyncTree']]):
+        if value is not self._parent:
+            self.invalidate_path_index()
+            self._parent = value
+            self.invalidate_local_dir()
+
+    @property
+    def metadata_local(self) -> Optional[SyncMetadataLocal]:
+        return self._metadata_local
+
+    @metadata_local.setter
+    def metadata_local(self, value: Optional[SyncMetadataLocal]):
+        previous, self._metadata_local = self._metadata_local, value
+        # Renames move all the nodes below
+        if getattr(previous, 'path', None) != getattr(value, 'path', None):
+            self.invalidate_path_index()
+            for child in self.child_nodes:
+                child.invalidate_local_dir()
+
+    @property
+    def children(self) -> List['SyncNode']:
+        # Most nodes are leaves, their list is only allocated once it is requested
+        if self._children is None:
+            self._children = []
+        return self._children
+
+    @children.setter
+    def children(self, value: List['SyncNode']):
+        self._children = value
+        self.invalidate_path_index()
+
+    @property
+    def child_nodes(self) -> Sequence['SyncNode']:
+        """
+        Children of the node without allocating a list for leaves. Use `children` to add children
+        :return:
+        """
+        return self._children or ()
+
+    @property
+    def synced_at(self) -> Optional[datetime]:
+        return expand_dt(self._synced_at)
+
+    @synced_at.setter
+    def synced_at(self, value: Optional[datetime]):
+        self._synced_at = compact_dt(value)
 
-    id: UUID = field(default_factory=lambda: uuid.uuid4())
-    parent: Optional[Union['SyncNode', 'SyncTree']] = None
-    children: List['SyncNode'] = field(default_factory=lambda: [])
-    node_type: SyncNodeType = field(default_factory=lambda: SyncNodeType.UNKNOWN)
-    node_role: Optional[SyncNodeRole] = None
-    metadata_notion: Optional[SyncMetadataNotion] = None
-    metadata_local: Optional[SyncMetadataLocal] = None
-    synced_at: Optional[datetime] = None
+    def __getstate__(self) -> Dict[str, Any]:
+        state = super().__getstate__()
+        state['children'] = self._children if self._children is not None else []
+        return state
 
     def copy_metadata_from(self, node: 'SyncNode'):
         """
@@ -107,7 +298,8 @@ class SyncNode(SecretYamlObject):
         self.metadata_local = node.metadata_local
         self.metadata_notion = node.metadata_notion
         self.node_role = node.node_role
-        self.synced_at = node.synced_at
+        # Already compact
+        self._synced_at = node._synced_at
 
     def clone_childless(self, parent: 'SyncNode'):
         """
@@ -132,47 +324,135 @@ class SyncNode(SecretYamlObject):
             filter_fn = lambda x: True
 
         def flatten_node(node: SyncNode):
-            children = itertools.chain(*[flatten_node(c) for c in node.children])
+            children = itertools.chain(*[flatten_node(c) for c in node._children or ()])
             return [node, *children] if filter_fn(node) else list(children)
 
         return flatten_node(self)
 
     def traverse(self) -> Iterable['SyncNode']:
         yield self
-        for c in self.children:
+        for c in self._children or ():
             yield from c.traverse()
 
+    def mark_synced(self):
+        """
+        Marks the node as synced and remembers the local content digest it was synced with
+        :return:
+        """
+        self.synced_at = datetime.now()
+        if self.metadata_local:
+            self.metadata_local.synced_digest = self.metadata_local.digest
+
     def changed(self) -> Tuple[bool, bool]:
+        # Compares the compact timestamps, which is a lot cheaper than expanding them for every node
+        local, notion, synced_at = self.metadata_local, self.metadata_notion, self._synced_at
         return (
-            (not self.metadata_notion or not self.synced_at or self.synced_at < self.metadata_local.updated_at)
-            if self.metadata_local else False,  # Changed local
-            (not self.metadata_local or not self.synced_at or self.synced_at < self.metadata_notion.updated_at)
-            if self.metadata_notion else False  # Changed notion
+            (not notion or synced_at is None or (
+                    is_before(synced_at, local._updated_at) and local.content_changed()
+            ))
+            if local else False,  # Changed local
+            (not local or synced_at is None or is_before(synced_at, notion._updated_at))
+            if notion else False  # Changed notion
         )
 
     def local_dir(self) -> Path:
-        parts = []
-        node = self.parent
-        while node is not None:
-            parts.append(node.metadata_local.path)
-            node = node.parent
-        if len(parts) == 0:
-            return ''
-        elif len(parts) == 1:
-            return parts[0]
-        return os.path.join(*reversed(parts))
+        """
+        Local directory of the node relative to the root dir. Cached until the node or one of its ancestors is
+        re-parented or renamed. The syncer runs the actions of a node after the ones of its ancestors, so concurrent
+        workers never rename a node while the paths below it are built
+        :return:
+        """
+        if self._local_dir is None:
+            self._local_dir = self._parent.local_path() if self._parent is not None else ''
+        return self._local_dir
+
+    def invalidate_local_dir(self):
+        """
+        Drops the cached local directories of the node and all the nodes below it. A node only caches its directory
+        after its parent did, so subtrees without a cached directory are skipped
+        :return:
+        """
+        self.invalidate_path_index()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node._local_dir is not None:
+                node._local_dir = None
+                stack.extend(node.child_nodes)
+
+    def invalidate_path_index(self):
+        """
+        Marks the path index of the tree owning the node for a rebuild, once the node is added, moved or renamed
+        :return:
+        """
+        node = self
+        while node._parent is not None:
+            node = node._parent
+        index = getattr(node, '_path_index', None)
+        if index is not None:
+            index.dirty = True
 
     def local_path(self) -> Path:
         return os.path.join(self.local_dir(), self.metadata_local.path)
 
 
-@dataclass
+class SyncPathIndex:
+    """
+    Index of the nodes of a tree by their local path. Rebuilt on the next lookup once a node of the tree is added,
+    re-parented or renamed
+    """
+    tree: SyncNode
+    nodes: Dict[Path, SyncNode]
+    dirty: bool
+
+    def __init__(self, tree: SyncNode) -> None:
+        super().__init__()
+        self.tree = tree
+        self.nodes = {}
+        self.dirty = True
+
+    def get(self, path: Path) -> Optional[SyncNode]:
+        """
+        Finds the node at the given local path
+        :param path: path relative to the root dir
+        :return: None if no existing node has the path
+        """
+        if self.dirty:
+            self.build()
+        node = self.nodes.get(os.path.normpath(path))
+        return node if node is not None and not node.metadata_local.deleted else None
+
+    def build(self):
+        # Cleared first, so changes made while building mark the index again
+        self.dirty = False
+        self.nodes = {
+            os.path.normpath(node.local_path()): node for node in self.tree.traverse()
+            if node.metadata_local is not None and not node.metadata_local.deleted
+        }
+
+
 class SyncTree(SyncNode):
+    __slots__ = ('notion_synced_at', 'local_synced_at', '_path_index')
     hidden_fields = ["parent"]
     yaml_tag = u'!SyncTree'
+    fields = SyncNode.fields + ('notion_synced_at', 'local_synced_at')
 
-    notion_synced_at: Optional[datetime] = None
-    local_synced_at: Optional[datetime] = None
+    def __init__(
+            self, notion_synced_at: Optional[datetime] = None, local_synced_at: Optional[datetime] = None, **kwargs
+    ) -> None:
+        self._path_index: Optional[SyncPathIndex] = None
+        super().__init__(**kwargs)
+        self.notion_synced_at = notion_synced_at
+        self.local_synced_at = local_synced_at
+
+    def path_index(self) -> SyncPathIndex:
+        """
+        Index answering local path to node lookups of the tree in O(1), rebuilt lazily after the tree changed
+        :return:
+        """
+        if self._path_index is None:
+            self._path_index = SyncPathIndex(self)
+        return self._path_index
 
     @staticmethod
     def create_local() -> 'SyncTree':
@@ -187,53 +467,3 @@ class SyncTree(SyncNode):
             node_type=SyncNodeType.ROOT,
             metadata_notion=SyncMetadataNotion(root_id, '')
         )
-
-
-@dataclass
-class SyncData(SecretYamlObject):
-    """
-    Data object storing all the necessary data for sync
-    """
-    hidden_fields = []
-    yaml_tag = u'!SyncData'
-
-    notion_tree: SyncTree
-    local_tree: SyncTree
-    root_dir: Path
-
-    def write(self):
-        path = os.path.join(self.root_dir, TREE_FILENAME)
-        logging.debug(f'Flushing SyncTree to: {path}')
-        with open(path, 'w') as f:
-            yaml.dump(self, f, default_flow_style=False)
-
-    def read(self):
-        path = os.path.join(self.root_dir, TREE_FILENAME)
-        if not os.path.exists(path):
-            logging.debug(f'No SyncTree found at: {path}')
-            return
-
-        logging.debug(f'Loading SyncTree from: {path}')
-        with open(path, 'r') as f:
-            data: SyncData = yaml.load(f, Loader=yaml.Loader)
-            self.notion_tree = data.notion_tree
-            self.local_tree = data.local_tree
-
-        # Fill parent fields which are not serialized
-        def propagate_parents(parent: Optional[SyncNode], node: SyncNode):
-            node.parent = parent
-            for child in node.children:
-                propagate_parents(node, child)
-        propagate_parents(None, self.notion_tree)
-        propagate_parents(None, self.local_tree)
-
-    def apply(self, tree: SyncTree):
-        nodes = {n.id: n for n in tree.flatten()}
-
-        for t in [self.notion_tree, self.local_tree]:
-            for node in t.traverse():
-                ref: SyncNode = nodes.get(node.id)
-                if ref is None: continue
-                node.metadata_notion = ref.metadata_notion
-                node.metadata_local = ref.metadata_local
-                node.synced_at = ref.synced_at
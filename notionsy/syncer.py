@@ -1,30 +1,159 @@
 import logging
 import os
 import shutil
-import time
-from dataclasses import dataclass
-from typing import List, Tuple, Dict, Union
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, Future
+from dataclasses import dataclass, field
+from typing import List, Tuple, Dict, Union, Optional, Iterable, Set
 
 from tqdm import tqdm
 
 from notionsy.local_provider import LocalProvider
 from notionsy.notion_provider import NotionProvider
-from notionsy.sync_planner import SyncAction, SyncActionTarget
-from notionsy.sync_tree import SyncNode
+from notionsy.sync_journal import SyncJournal
+from notionsy.sync_planner import SyncAction, SyncActionTarget, SyncActionType
+from notionsy.sync_tree import SyncNode, GUID, SyncNodeType
+from notionsy.utils.merge import MergeBase
 
 Content = str
 
 
 @dataclass
 class Syncer:
+    """
+    Executes the sync plan on the providers. With multiple workers independent branches of the tree are synced
+    concurrently, while the actions of a node always wait for the actions of its parent and related nodes
+    """
     providers: Dict[SyncActionTarget, Union[NotionProvider, LocalProvider]]
+    journal: Optional[SyncJournal] = None
+    workers: int = 1
+    # Maximum number of concurrent actions per target. Targets without a limit are only bound by the workers
+    target_workers: Dict[SyncActionTarget, int] = field(default_factory=dict)
+    # Keeps the synced contents of the notes to merge concurrent edits against
+    merge_base: Optional[MergeBase] = None
 
-    def sync(self, actions: List[SyncAction]):
-        targets = set(self.providers.keys())
+    def __post_init__(self):
+        self.lock = threading.Lock()
+        self.semaphores = {
+            target: threading.BoundedSemaphore(limit)
+            for target, limit in self.target_workers.items() if limit > 0
+        }
 
-        for action in tqdm(actions):
-            logging.info(f'EXECUTING: {action}')
+    def sync(self, actions: Iterable[SyncAction]):
+        try:
+            if self.workers <= 1:
+                for action in tqdm(actions):
+                    self.execute(action)
+            else:
+                self.sync_parallel(list(actions))
+        finally:
+            if self.journal:
+                self.journal.flush()
+
+    def sync_parallel(self, actions: List[SyncAction]):
+        """
+        Runs the actions on a pool of workers as soon as all the actions they depend on are completed. Stops
+        scheduling actions once any action failed and raises its error after the running actions finished
+        :param actions:
+        :return:
+        """
+        dependencies = action_dependencies(actions)
+        remaining = [len(required) for required in dependencies]
+        dependents: List[List[int]] = [[] for _ in actions]
+        for i, required in enumerate(dependencies):
+            for j in required:
+                dependents[j].append(i)
+
+        progress = tqdm(total=len(actions))
+        error: Optional[BaseException] = None
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='notionsy-sync') as executor:
+            pending: Dict[Future, int] = {
+                executor.submit(self.execute, actions[i]): i for i, count in enumerate(remaining) if count == 0
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = pending.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                        continue
+                    progress.update()
+                    if error is not None:
+                        continue
+                    for j in dependents[i]:
+                        remaining[j] -= 1
+                        if remaining[j] == 0:
+                            pending[executor.submit(self.execute, actions[j])] = j
+        progress.close()
+
+        if error is not None:
+            raise error
+
+    def execute(self, action: SyncAction):
+        logging.info(f'EXECUTING: {action}')
+        other = next(target for target in self.providers.keys() if target != action.action_target)
+        with self.limit(action.action_target):
             self.providers[action.action_target].action_downstream(action)
-            other = list((targets - {action.action_target}))[0]
+        with self.limit(other):
             self.providers[other].action_upstream(action)
-            time.sleep(5)
+        if self.merge_base is not None and action.node.node_type == SyncNodeType.NOTE:
+            self.update_merge_base(action)
+        if self.journal:
+            with self.lock:
+                self.journal.record(action)
+
+    def update_merge_base(self, action: SyncAction):
+        key = str(action.node.id)
+        if action.action_type == SyncActionType.DELETE:
+            self.merge_base.remove(key)
+        elif action.action_type in (SyncActionType.FETCH, SyncActionType.MERGE) and action.content is not None:
+            self.merge_base.put(key, action.content)
+
+    def limit(self, target: SyncActionTarget) -> Union[threading.BoundedSemaphore, 'NoLimit']:
+        return self.semaphores.get(target, NO_LIMIT)
+
+
+class NoLimit:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NO_LIMIT = NoLimit()
+
+
+def action_dependencies(actions: List[SyncAction]) -> List[Set[int]]:
+    """
+    Builds the dependency graph of the planned actions. An action depends on the previous action of its node, the
+    last action of its nearest ancestor with actions and the last actions of the notion items it relates to.
+    Only earlier actions are depended on, so the graph is acyclic and the plan order is a valid execution order
+    :param actions: actions in plan order, parents before their children
+    :return: indices of the required actions for every action
+    """
+    last: Dict[int, int] = {}
+    last_notion: Dict[GUID, int] = {}
+    dependencies: List[Set[int]] = []
+    for i, action in enumerate(actions):
+        node = action.node
+        required = set()
+        if id(node) in last:
+            required.add(last[id(node)])
+
+        ancestor = node.parent
+        while ancestor is not None:
+            if id(ancestor) in last:
+                required.add(last[id(ancestor)])
+                break
+            ancestor = ancestor.parent
+
+        if node.metadata_notion is not None:
+            for related in node.metadata_notion.relations.values():
+                required.update(last_notion[related_id] for related_id in related if related_id in last_notion)
+
+        dependencies.append(required)
+        last[id(node)] = i
+        if node.metadata_notion is not None:
+            last_notion[node.metadata_notion.id] = i
+    return dependencies
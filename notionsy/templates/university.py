@@ -3,30 +3,51 @@ import logging
 import time
 from dataclasses import dataclass
 from datetime import datetime
+from difflib import SequenceMatcher
+from typing import Optional, List, Dict, Tuple, Type
 
 from md2notion.NotionPyRenderer import LatexNotionPyRenderer
-from md2notion.upload import upload
-from notion.block import CollectionViewBlock, Block
+from md2notion.upload import upload, convert, uploadBlock
+from notion.block import CollectionViewBlock, Block, EmbedOrUploadBlock
+from notion.markdown import markdown_to_notion, notion_to_markdown
 from notion.client import NotionClient
 from notion.collection import Collection
+from requests import RequestException
 
+from notionsy.sync_estimator import SyncEstimate
 from notionsy.sync_mapping import Mapping, NotionResourceMapper, SyncConfig
 from notionsy.sync_planner import SyncAction
 from notionsy.sync_tree import SyncNodeType, SyncMetadataNotion, Path, GUID
+from notionsy.utils.rate_limit import RateLimiter, is_transient
 
 UNIVERSITY_LOCAL_MAPPING = Mapping({r'^.+/$': 'course', r'^.+/.+$': 'lecture'})
 UNIVERSITY_NOTION_MAPPING = Mapping({r'^.+ Courses\/.+$': 'course', r'^Lectures\/.+$': 'lecture'})
 UNIVERSITY_STRUCTURE_MAPPING = {'course': SyncNodeType.GROUP, 'lecture': SyncNodeType.NOTE}
 UNIVERSITY_HIERARCHY = ['course', 'lecture']
 
+# md2notion adds blocks one by one: a transaction creating the block followed by one setting its properties
+WRITES_PER_UPLOADED_BLOCK = 2
+
+# Uploads failing with a transient error are retried with an exponential backoff
+UPLOAD_ATTEMPTS = 3
+UPLOAD_BACKOFF = 10.0
+
+# Keys of md2notion block descriptors which are not block properties
+DESCRIPTOR_STRUCTURE_KEYS = {'type', 'children', 'schema', 'rows'}
+
+BlockDescriptor = dict
+Signature = Tuple
+
 
 @dataclass
 class UniversityResourceMapper(NotionResourceMapper):
     client: NotionClient
+    rate_limiter: Optional[RateLimiter] = None
 
-    def __init__(self, client: NotionClient) -> None:
+    def __init__(self, client: NotionClient, rate_limiter: Optional[RateLimiter] = None) -> None:
         super().__init__({})
         self.client = client
+        self.rate_limiter = rate_limiter
 
     def create_course(self, action: SyncAction):
         parent = self.content_mapping.get(action.node.node_role)
@@ -75,34 +96,199 @@ class UniversityResourceMapper(NotionResourceMapper):
         )
 
     def update_lecture(self, action: SyncAction):
-        self.upload_content(
-            action.node.metadata_notion.id,
-            action.content,
-            action.node.metadata_local.path.replace('.md', ''),
-            True
-        )
+        page_id = action.node.metadata_notion.id
+        name = action.node.metadata_local.path.replace('.md', '')
+        try:
+            self.update_content(page_id, action.content, name)
+        except Exception as e:
+            logging.error(f'Error occurred while updating content, uploading it again: {e}')
+            self.upload_content(page_id, action.content, name, True)
         action.node.metadata_notion.updated_at = datetime.now()
 
+    def estimate_create_course(self, action: SyncAction) -> SyncEstimate:
+        # The collections are known from the fetch. Row creation, title, list view creation and its filter
+        return SyncEstimate(blocks=2, writes=5)
+
+    def estimate_update_course(self, action: SyncAction) -> SyncEstimate:
+        return SyncEstimate()
+
+    def estimate_create_lecture(self, action: SyncAction) -> SyncEstimate:
+        blocks = count_blocks(convert(action.content, LatexNotionPyRenderer))
+        # The collection is known from the fetch. Row creation, title and course relation followed by the page upload
+        return SyncEstimate(blocks=blocks, writes=4 + WRITES_PER_UPLOADED_BLOCK * blocks)
+
+    def estimate_update_lecture(self, action: SyncAction) -> SyncEstimate:
+        blocks = count_blocks(convert(action.content, LatexNotionPyRenderer))
+        # Page and children refresh followed by the changed blocks. Without the old content the whole page is assumed
+        # to change
+        return SyncEstimate(api_calls=2, blocks=blocks, writes=WRITES_PER_UPLOADED_BLOCK * blocks)
+
+    def update_content(self, page_id: GUID, content: str, name: str) -> Block:
+        """
+        Updates the content of a page by only changing the blocks which differ from the rendered markdown
+        :param page_id:
+        :param content:
+        :param name:
+        :return:
+        """
+        page = self.client.get_block(page_id, force_refresh=True)
+        self.update_children(page, list(page.children), convert(content, LatexNotionPyRenderer), name)
+        return page
+
+    def update_children(self, parent: Block, blocks: List[Block], descriptors: List[BlockDescriptor], name: str):
+        """
+        Diffs the existing children of the parent against the block descriptors rendered by md2notion by type and
+        content. Matching blocks are kept, blocks of the same type are updated in place, and the rest is removed
+        or inserted at its position
+        :param parent:
+        :param blocks: current children of the parent
+        :param descriptors: children the parent should have
+        :param name: name of the markdown file to resolve local images with
+        :return:
+        """
+        keys = descriptor_keys(descriptors)
+        matcher = SequenceMatcher(
+            None, [block_signature(block, keys) for block in blocks],
+            [descriptor_signature(descriptor, keys) for descriptor in descriptors], autojunk=False
+        )
+
+        # Steps in the order of the resulting children: (old block, new descriptor)
+        steps: List[Tuple[Optional[Block], Optional[BlockDescriptor]]] = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            old, new = blocks[i1:i2], descriptors[j1:j2]
+            if tag == 'equal':
+                steps.extend(zip(old, new))
+                continue
+            for k in range(max(len(old), len(new))):
+                block = old[k] if k < len(old) else None
+                descriptor = new[k] if k < len(new) else None
+                if block is not None and descriptor is not None and updatable(block, descriptor):
+                    steps.append((block, descriptor))
+                else:
+                    if block is not None:
+                        steps.append((block, None))
+                    if descriptor is not None:
+                        steps.append((None, descriptor))
+
+        remaining = sum(1 for block, descriptor in steps if block is not None and descriptor is not None)
+        previous: Optional[Block] = None
+        for block, descriptor in steps:
+            if descriptor is None:
+                block.remove()
+            elif block is None:
+                uploadBlock(descriptor, parent, name)
+                block = self.client.get_block(parent.get('content')[-1])
+                # New blocks are appended, move them in front of the blocks which are kept
+                if remaining > 0:
+                    block.move_to(previous, 'after') if previous else block.move_to(parent, 'first-child')
+                previous = block
+            else:
+                remaining -= 1
+                for key, value in descriptor_props(descriptor).items():
+                    if normalize(key, getattr(block, key, None)) != normalize(key, value):
+                        setattr(block, key, value)
+                children = descriptor.get('children') or []
+                if children or block.get('content'):
+                    self.update_children(block, list(block.children), children, name)
+                previous = block
+
     def upload_content(self, page_id: GUID, content: str, name: str, clear: bool = True) -> Block:
-        while True:
+        """
+        Replaces the content of the page by the uploaded markdown. Transient errors are retried with a backoff through
+        the rate limiter, any other error is raised. Writes queued by the batcher are retried by the batcher itself
+        :param page_id:
+        :param content:
+        :param name:
+        :param clear: whether the page has existing content to remove
+        :return:
+        """
+        for attempt in range(UPLOAD_ATTEMPTS):
             try:
-                page = self.client.get_block(page_id, force_refresh=True)
+                # A page which is not cleared was just created, the local record store already has it
+                page = self.client.get_block(page_id, force_refresh=clear)
                 if clear:
                     for child in page.children:
                         child.remove()
-                time.sleep(2)
                 contentFile = io.StringIO(content)
                 contentFile.__dict__["name"] = name
                 upload(contentFile, page, notionPyRendererCls=LatexNotionPyRenderer)
-                break
-            except Exception as e:
-                logging.error(f'Error occurred while uploading content: {e}')
+                return page
+            except RequestException as e:
+                if attempt + 1 >= UPLOAD_ATTEMPTS or not is_transient(e):
+                    raise
+                delay = UPLOAD_BACKOFF * 2 ** attempt
+                logging.warning(f'Error occurred while uploading content, retrying in {delay:.0f}s: {e}')
+                # A partial upload is cleared by the next attempt
                 clear = True
-                time.sleep(10)
-        return page
+                self.backoff(delay)
+
+    def backoff(self, seconds: float):
+        if self.rate_limiter is not None:
+            self.rate_limiter.backoff(seconds)
+        else:
+            time.sleep(seconds)
+
+
+def count_blocks(descriptors: List[dict]) -> int:
+    """
+    Counts the blocks md2notion will upload for the given block descriptors including nested ones
+    :param descriptors:
+    :return:
+    """
+    return sum(1 + count_blocks(d.get('children') or []) for d in descriptors)
+
+
+def descriptor_props(descriptor: BlockDescriptor) -> dict:
+    return {key: value for key, value in descriptor.items() if key not in DESCRIPTOR_STRUCTURE_KEYS}
+
+
+def descriptor_keys(descriptors: List[BlockDescriptor]) -> Dict[Type[Block], List[str]]:
+    """
+    Collects the compared property keys per block type
+    :param descriptors:
+    :return:
+    """
+    keys = {}
+    for descriptor in descriptors:
+        keys.setdefault(descriptor['type'], sorted(descriptor_props(descriptor).keys()))
+    return keys
+
+
+def normalize(key: str, value):
+    # Markdown titles are stored as notion rich text, compare them the way they are read back
+    if key == 'title' and isinstance(value, str):
+        return notion_to_markdown(markdown_to_notion(value))
+    return value
+
+
+def block_signature(block: Block, keys: Dict[Type[Block], List[str]]) -> Signature:
+    block_type = type(block)
+    if block_type not in keys:
+        return block_type, block.id
+    return block_type, tuple(repr(normalize(key, getattr(block, key, None))) for key in keys[block_type])
+
+
+def descriptor_signature(descriptor: BlockDescriptor, keys: Dict[Type[Block], List[str]]) -> Signature:
+    if 'schema' in descriptor:
+        # Tables are always uploaded again
+        return descriptor['type'], id(descriptor)
+    return descriptor['type'], tuple(repr(normalize(key, descriptor.get(key))) for key in keys[descriptor['type']])
+
+
+def updatable(block: Block, descriptor: BlockDescriptor) -> bool:
+    """
+    Whether the block can be turned into the described block by setting its properties
+    :param block:
+    :param descriptor:
+    :return:
+    """
+    return type(block) is descriptor['type'] and 'schema' not in descriptor and \
+        not issubclass(descriptor['type'], EmbedOrUploadBlock)
 
 
-def build_config(root_dir: Path, notion_root: GUID, client: NotionClient) -> SyncConfig:
+def build_config(
+        root_dir: Path, notion_root: GUID, client: NotionClient, rate_limiter: Optional[RateLimiter] = None
+) -> SyncConfig:
     return SyncConfig(
         root_dir,
         notion_root,
@@ -110,5 +296,6 @@ def build_config(root_dir: Path, notion_root: GUID, client: NotionClient) -> Syn
         UNIVERSITY_NOTION_MAPPING,
         UNIVERSITY_STRUCTURE_MAPPING,
         UNIVERSITY_HIERARCHY,
-        UniversityResourceMapper(client=client)
+        UniversityResourceMapper(client, rate_limiter),
+        rate_limiter
     )
@@ -1,2 +1,13 @@
 from . import notion
 from . import serialization
+from . import hash_cache
+from . import rate_limit
+from . import block_cache
+from . import downloader
+from . import transport
+from . import watcher
+from . import scanner
+from . import batcher
+from . import merge
+from . import snapshot
+from . import request_memo
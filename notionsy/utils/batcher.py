@@ -0,0 +1,150 @@
+__all__ = ['NotionBatcher']
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, List, Optional
+
+from notion.client import NotionClient
+from requests import RequestException
+
+from notionsy.utils.rate_limit import RateLimiter, is_transient
+
+Operation = dict
+
+# Batches failing with a transient error are submitted again with an exponential backoff
+SUBMIT_ATTEMPTS = 3
+SUBMIT_BACKOFF = 10.0
+
+
+class NotionBatcher:
+    """
+    Queues the write transactions of a client while batching and submits them together as one transaction of at
+    most `max_operations` operations. notion-py applies every write to its local record store right away, so reads
+    of the created records are answered locally. Any request reaching the server flushes the queue first, so the
+    server never sees reads and writes out of order. A non positive maximum disables batching.
+
+    Operations leave the queue only once their batch was submitted. A batch failing for good stays queued and its
+    error is raised by every following flush, so the journal never records actions whose writes did not reach the
+    server
+    """
+    max_operations: int
+    rate_limiter: Optional[RateLimiter]
+
+    def __init__(self, max_operations: int = 100, rate_limiter: Optional[RateLimiter] = None) -> None:
+        super().__init__()
+        self.max_operations = max_operations
+        self.rate_limiter = rate_limiter
+        self.operations: List[Operation] = []
+        # Number of queued operations at the front which are being submitted
+        self.submitting = 0
+        self.depth = 0
+        self.post: Optional[Callable] = None
+        self.lock = threading.Lock()
+        # Held while submitting, so queued batches reach the server in the order they were queued
+        self.flush_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_operations > 0
+
+    @property
+    def batching(self) -> bool:
+        return self.enabled and self.depth > 0
+
+    @contextmanager
+    def batch(self):
+        """
+        Queues the write transactions within the context, which are flushed once the outermost batch exits
+        :return:
+        """
+        with self.lock:
+            self.depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.depth -= 1
+            self.flush()
+
+    def flush(self):
+        """
+        Submits all the queued operations. Raises the error of the first batch which could not be submitted, which
+        is kept queued together with the operations after it
+        :return:
+        """
+        with self.flush_lock:
+            with self.lock:
+                remaining = len(self.operations)
+            size = max(1, self.max_operations)
+            while remaining > 0:
+                with self.lock:
+                    chunk = self.operations[:min(size, remaining)]
+                    self.submitting = len(chunk)
+                try:
+                    self.submit(chunk)
+                finally:
+                    with self.lock:
+                        self.submitting = 0
+                # Operations are only appended meanwhile, so the submitted ones are still in front
+                with self.lock:
+                    del self.operations[:len(chunk)]
+                remaining -= len(chunk)
+
+    def submit(self, operations: List[Operation]):
+        """
+        Submits the operations as one transaction. Transient errors are retried with a backoff through the rate
+        limiter, any other error is raised
+        :param operations:
+        :return:
+        """
+        for attempt in range(SUBMIT_ATTEMPTS):
+            try:
+                logging.debug(f'Submitting a batch of {len(operations)} notion operations')
+                self.post('submitTransaction', {'operations': operations})
+                return
+            except RequestException as e:
+                if attempt + 1 >= SUBMIT_ATTEMPTS or not is_transient(e):
+                    raise
+                delay = SUBMIT_BACKOFF * 2 ** attempt
+                logging.warning(f'Error occurred while submitting a batch, retrying in {delay:.0f}s: {e}')
+                if self.rate_limiter is not None:
+                    self.rate_limiter.backoff(delay)
+                else:
+                    time.sleep(delay)
+
+    def queue(self, fn: Callable) -> Callable:
+        """
+        Wraps the given post function so that write transactions are queued while batching
+        :param fn:
+        :return:
+        """
+        self.post = fn
+
+        @wraps(fn)
+        def wrapper(endpoint, data):
+            if not self.batching or endpoint != 'submitTransaction':
+                self.flush()
+                return fn(endpoint, data)
+
+            with self.lock:
+                self.operations.extend(data['operations'])
+                full = len(self.operations) - self.submitting >= self.max_operations
+            if full:
+                self.flush()
+            # notion-py ignores the response of transactions
+            return None
+
+        return wrapper
+
+    def install(self, client: NotionClient) -> NotionClient:
+        """
+        Routes all the api requests of the given client through the batcher. Should be installed after the rate
+        limiter, so only the submitted batches are rate limited
+        :param client:
+        :return:
+        """
+        client.post = self.queue(client.post)
+        return client
@@ -0,0 +1,144 @@
+__all__ = ['BlockCache', 'BLOCK_CACHE_FILENAME']
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Any
+
+from notion.block import Block
+from notion.client import NotionClient
+
+from notionsy.utils.serialization import json_dumps, json_loads, atomic_open
+
+BLOCK_CACHE_FILENAME = '.sync.blocks'
+
+BlockRecord = Dict[str, Any]
+
+
+class BlockCache:
+    """
+    On-disk cache of the block records of exported pages. A page is keyed by its id and its version / last edited
+    time, so unchanged pages are loaded from disk while edited pages are requested from notion again.
+    Least recently used pages are evicted once the cache holds more than `max_records` block records
+    """
+    root_dir: str
+    client: NotionClient
+    max_records: int
+
+    def __init__(self, root_dir: str, client: NotionClient, max_records: int = 100000) -> None:
+        super().__init__()
+        self.root_dir = root_dir
+        self.client = client
+        self.max_records = max_records
+        self.pages: 'OrderedDict[str, dict]' = OrderedDict()
+        self.size = 0
+        self.hydrated: Set[str] = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loaded_records = 0
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.root_dir, BLOCK_CACHE_FILENAME)
+
+    def read(self):
+        if not os.path.exists(self.path):
+            logging.debug(f'No BlockCache found at: {self.path}')
+            return
+
+        logging.debug(f'Loading BlockCache from: {self.path}')
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json_loads(line)
+                except ValueError:
+                    logging.warning(f'Skipping corrupt BlockCache entry in: {self.path}')
+                    continue
+                self.pages[entry['id']] = entry
+                self.size += len(entry['records'])
+        self.evict()
+
+    def write(self):
+        logging.debug(f'Flushing BlockCache to: {self.path}')
+        with self.lock, atomic_open(self.path, 'wb') as f:
+            # Least recently used pages first, so the order survives a reload
+            for entry in self.pages.values():
+                f.write(json_dumps(entry))
+                f.write(b'\n')
+
+    def load(self, page: Block) -> bool:
+        """
+        Loads the cached block records of the page into the client if the page did not change since it was cached
+        :param page:
+        :return: whether the page was served from the cache
+        """
+        with self.lock:
+            if not self.is_fresh(page):
+                self.misses += 1
+                return False
+
+            entry = self.pages[page.id]
+
+            self.pages.move_to_end(page.id)
+            self.hits += 1
+            self.loaded_records += len(entry['records'])
+            self.hydrated.add(page.id)
+            self.hydrated.update(entry['records'].keys())
+
+        self.client._store.store_recordmap({'block': {
+            block_id: {'role': 'reader', 'value': value} for block_id, value in entry['records'].items()
+        }})
+        return True
+
+    def is_fresh(self, page: Block) -> bool:
+        """
+        Whether the cached block records of the page are still up to date
+        :param page:
+        :return:
+        """
+        entry = self.pages.get(page.id)
+        return entry is not None and entry['version'] == page_version(page)
+
+    def children(self, block: Block) -> List[Block]:
+        """
+        Returns the children of the block without requesting them from notion if they were loaded from the cache
+        :param block:
+        :return:
+        """
+        if block.id not in self.hydrated:
+            return block.children
+        return [self.client.get_block(child_id) for child_id in block.get('content') or []]
+
+    def store(self, page: Block, records: Dict[str, BlockRecord]):
+        """
+        Caches the records of the blocks within the given page
+        :param page:
+        :param records:
+        :return:
+        """
+        with self.lock:
+            old = self.pages.pop(page.id, None)
+            if old is not None:
+                self.size -= len(old['records'])
+
+            self.pages[page.id] = {'id': page.id, 'version': page_version(page), 'records': records}
+            self.size += len(records)
+            self.evict()
+
+    def evict(self):
+        while self.size > self.max_records and self.pages:
+            _, entry = self.pages.popitem(last=False)
+            self.size -= len(entry['records'])
+            self.evictions += 1
+
+    def summary(self) -> str:
+        return f'Block cache: {self.hits} pages from cache, {self.misses} pages fetched, ' \
+               f'{self.loaded_records} block records loaded from disk, {self.evictions} pages evicted, ' \
+               f'{len(self.pages)} pages / {self.size} block records cached'
+
+
+def page_version(page: Block) -> Optional[list]:
+    return [page.get('version'), page.get('last_edited_time')]
@@ -0,0 +1,64 @@
+__all__ = ['Downloader', 'download']
+
+import logging
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 1 << 16
+
+
+class Downloader:
+    """
+    Downloads files in the background through a single pooled http session, so connections are kept alive
+    between downloads and at most `workers` downloads run at the same time
+    """
+    workers: int
+
+    def __init__(self, workers: int = 4) -> None:
+        super().__init__()
+        self.workers = max(1, workers)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='notionsy-download')
+
+    def submit(self, url: str, directory: str, filename: str) -> 'Future[str]':
+        """
+        Schedules the download of the given url into the directory
+        :param url:
+        :param directory:
+        :param filename: name of the file without extension. The extension is guessed from the content type
+        :return: future resolving to the path of the downloaded file, or the bare filename if the download failed
+        """
+        return self.executor.submit(download, url, directory, filename, self.session)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+
+def download(url: str, directory: str, filename: str, session=requests) -> str:
+    """
+    Downloads the given url into the directory
+    :param url:
+    :param directory:
+    :param filename: name of the file without extension. The extension is guessed from the content type
+    :param session: session to request the file with
+    :return: path of the downloaded file, or the bare filename if the download failed
+    """
+    try:
+        with session.get(url, allow_redirects=True, stream=True) as r:
+            content_type = r.headers['content-type']
+            path = os.path.abspath(os.path.join(directory, f'{filename}{mimetypes.guess_extension(content_type)}'))
+            with open(path, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+    except Exception as e:
+        logging.exception(e)
+        path = filename
+    return path
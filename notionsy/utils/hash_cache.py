@@ -0,0 +1,78 @@
+__all__ = ['HashCache', 'HASH_CACHE_FILENAME']
+
+import hashlib
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+from notionsy.utils.serialization import json_dumps, json_loads
+
+HASH_CACHE_FILENAME = '.sync.hashes'
+CHUNK_SIZE = 1 << 16
+
+StatKey = Tuple[int, int, int]
+
+
+class HashCache:
+    """
+    Persistent cache of file content digests keyed by (inode, size, mtime) so unchanged files are never re-read
+    """
+    root_dir: str
+    entries: Dict[str, Tuple[StatKey, str]]
+
+    def __init__(self, root_dir: str) -> None:
+        super().__init__()
+        self.root_dir = root_dir
+        self.entries = {}
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.root_dir, HASH_CACHE_FILENAME)
+
+    def read(self):
+        if not os.path.exists(self.path):
+            logging.debug(f'No HashCache found at: {self.path}')
+            return
+
+        logging.debug(f'Loading HashCache from: {self.path}')
+        try:
+            with open(self.path, 'rb') as f:
+                self.entries = {k: (tuple(key), digest) for k, (key, digest) in json_loads(f.read()).items()}
+        except (ValueError, TypeError) as e:
+            logging.warning(f'Discarding corrupt HashCache at {self.path}: {e}')
+            self.entries = {}
+
+    def write(self):
+        logging.debug(f'Flushing HashCache to: {self.path}')
+        with open(self.path, 'wb') as f:
+            f.write(json_dumps({k: [list(key), digest] for k, (key, digest) in self.entries.items()}))
+
+    def digest(self, path: str, stat: Optional[os.stat_result] = None) -> str:
+        """
+        Returns the content digest of the given file. The file is only read if its stat key changed
+        :param path: path of the file relative to the root dir
+        :param stat: stat result of the file if already known
+        :return:
+        """
+        full_path = os.path.join(self.root_dir, path)
+        stat = stat or os.stat(full_path)
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        digest = file_digest(full_path)
+        self.entries[path] = (key, digest)
+        return digest
+
+    def discard(self, path: str):
+        self.entries.pop(path, None)
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
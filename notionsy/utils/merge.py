@@ -0,0 +1,153 @@
+__all__ = ['MergeBase', 'MERGE_BASE_DIRNAME', 'merge3', 'normalize_lines']
+
+import logging
+import os
+from difflib import SequenceMatcher
+from typing import List, Optional, Tuple
+
+MERGE_BASE_DIRNAME = '.sync.base'
+
+
+class MergeBase:
+    """
+    Stores the last synced content of every note, one file per node, so concurrent edits of both sides can be
+    merged against it. Only the notes synced by a run are written
+    """
+    root_dir: str
+
+    def __init__(self, root_dir: str) -> None:
+        super().__init__()
+        self.root_dir = root_dir
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.root_dir, MERGE_BASE_DIRNAME)
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}.md')
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self.entry_path(key), 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, content: str):
+        os.makedirs(self.path, exist_ok=True)
+        path = self.entry_path(key)
+        with open(f'{path}.tmp', 'w') as f:
+            f.write(content)
+        os.replace(f'{path}.tmp', path)
+
+    def remove(self, key: str):
+        try:
+            os.remove(self.entry_path(key))
+        except FileNotFoundError:
+            pass
+
+
+class Line:
+    """
+    Line of a markdown text together with the blank lines following it. Lines compare by their content only, since
+    the markdown export of notion does not preserve blank lines and trailing whitespace
+    """
+    __slots__ = ('text', 'key')
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.key = text.rstrip()
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Line) and self.key == other.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def with_layout(self, layout: 'Line') -> 'Line':
+        return Line(self.key + layout.text[len(layout.key):])
+
+
+# Replacement of the base lines [start, end) by the given lines
+Hunk = Tuple[int, int, List[Line]]
+
+
+def split_lines(text: str) -> Tuple[str, List[Line]]:
+    """
+    Splits a text into lines with content, which keep the blank lines following them
+    :param text:
+    :return: the leading blank lines and the lines
+    """
+    lines: List[str] = []
+    prefix = ''
+    for line in text.splitlines(keepends=True):
+        if not line.endswith('\n'):
+            line += '\n'
+        if line.strip():
+            lines.append(line)
+        elif lines:
+            lines[-1] += line
+        else:
+            prefix += line
+    return prefix, [Line(line) for line in lines]
+
+
+def hunks(base: List[Line], other: List[Line]) -> List[Hunk]:
+    return [
+        (i1, i2, other[j1:j2])
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, base, other, autojunk=False).get_opcodes()
+        if tag != 'equal'
+    ]
+
+
+def merge3(base: str, local: str, remote: str) -> Optional[str]:
+    """
+    Merges the changes of two versions of a markdown text line by line against their common base, by applying the
+    remote changes to the local version. Changes of both sides merge if they are the same change or are separated by
+    at least one unchanged line of the base. Blank lines and trailing whitespace are not compared, the local layout
+    is kept
+    :param base: last synced content
+    :param local:
+    :param remote:
+    :return: the merged text, None if both sides changed the same lines differently
+    """
+    _, base_lines = split_lines(base)
+    prefix, local_lines = split_lines(local)
+    _, remote_lines = split_lines(remote)
+    local_hunks, remote_hunks = hunks(base_lines, local_lines), hunks(base_lines, remote_lines)
+
+    merged: List[Line] = []
+    position, offset, i = 0, 0, 0
+    for start, end, lines in remote_hunks:
+        # Local changes before the remote change shift its position in the local version
+        while i < len(local_hunks) and local_hunks[i][1] < start:
+            offset += len(local_hunks[i][2]) - (local_hunks[i][1] - local_hunks[i][0])
+            i += 1
+        if i < len(local_hunks) and local_hunks[i][0] <= end:
+            if local_hunks[i] == (start, end, lines):
+                continue
+            logging.debug(f'Overlapping changes of lines {start + 1} to {end}')
+            return None
+
+        local_start, local_end = start + offset, end + offset
+        if lines:
+            # The changed lines take over the blank lines after the lines they replace or follow
+            layout = local_lines[local_end - 1] if local_end > local_start else \
+                local_lines[local_start - 1] if local_start > 0 else None
+            if layout is not None:
+                lines = lines[:-1] + [lines[-1].with_layout(layout)]
+        merged += local_lines[position:local_start] + lines
+        position = local_end
+
+    merged += local_lines[position:]
+    return prefix + ''.join(line.text for line in merged)
+
+
+def normalize_lines(text: str) -> str:
+    """
+    Drops the blank lines and trailing whitespace of a markdown text, which the markdown export of notion does not
+    preserve, so exported and local versions of a note can be compared line by line
+    :param text:
+    :return:
+    """
+    return ''.join(f'{line}\n' for line in map(str.rstrip, text.splitlines()) if line)
@@ -1,10 +1,12 @@
 __all__ = ['get_page_by_name', 'get_prop_by_name', 'iterate', 'filter_date_after', 'find_prop', 'default_dt',
-           'to_local_dt']
+           'to_local_dt', 'thread_local_transactions']
 
+import threading
 from copy import copy
 from datetime import datetime, timezone
 from typing import Union, Optional
 
+from notion.client import NotionClient
 from notion.block import Block, CollectionViewPageBlock, CollectionViewBlock, PageBlock
 from notion.collection import Collection, CollectionRowBlock, CollectionQuery
 from dateutil import tz
@@ -106,3 +108,45 @@ def default_dt():
 
 def to_local_dt(dt: Optional[datetime]) -> Optional[datetime]:
     return dt.replace(tzinfo=tz.tzutc()).astimezone(tz=tz.tzlocal()).replace(tzinfo=None) if dt else None
+
+
+# Attributes in which notion-py keeps the state of the current transaction on the client
+TRANSACTION_ATTRIBUTES = ('_transaction_operations', '_pages_to_refresh', '_blocks_to_refresh')
+
+
+def thread_local_attribute(name: str) -> property:
+    def getter(self):
+        try:
+            return getattr(self._transaction_state, name)
+        except AttributeError:
+            raise AttributeError(name) from None
+
+    def setter(self, value):
+        setattr(self._transaction_state, name, value)
+
+    def deleter(self):
+        delattr(self._transaction_state, name)
+
+    return property(getter, setter, deleter)
+
+
+class ThreadLocalTransactions:
+    pass
+
+
+for attribute in TRANSACTION_ATTRIBUTES:
+    setattr(ThreadLocalTransactions, attribute, thread_local_attribute(attribute))
+
+
+def thread_local_transactions(client: NotionClient) -> NotionClient:
+    """
+    Keeps the transactions of the given client per thread. notion-py stores the current transaction on the client,
+    so concurrent threads would otherwise submit, or lose, each others operations
+    :param client:
+    :return:
+    """
+    if isinstance(client, ThreadLocalTransactions):
+        return client
+    client._transaction_state = threading.local()
+    client.__class__ = type(client.__class__.__name__, (ThreadLocalTransactions, client.__class__), {})
+    return client
@@ -1,20 +1,50 @@
-import logging
-import mimetypes
 import os
 import uuid
+from concurrent.futures import Future
 from dataclasses import field, dataclass
-from typing import List
+from functools import lru_cache
+from typing import List, Optional, Dict, Callable, Type, Tuple
 
-import requests
 from notion.block import Block, HeaderBlock, SubheaderBlock, SubsubheaderBlock, TextBlock, BookmarkBlock, VideoBlock, \
     BulletedListBlock, NumberedListBlock, ImageBlock, CodeBlock, EquationBlock, DividerBlock, TodoBlock, QuoteBlock, \
     ColumnBlock, ColumnListBlock, FileBlock, AudioBlock, PDFBlock, GistBlock
 
+from notionsy.utils.block_cache import BlockCache, BlockRecord
+from notionsy.utils.downloader import Downloader, download
+
+Renderer = Callable[['NotionMarkdownExporter', Block, int], None]
+
+RENDERERS: Dict[Type[Block], Renderer] = {}
+
+
+def register_renderer(*block_types: Type[Block]) -> Callable[[Renderer], Renderer]:
+    """
+    Registers the decorated function as the markdown renderer of the given block types. The renderer receives the
+    exporter, the block and the indent, and writes the markdown of the block (without its indent) to the exporter
+    :param block_types:
+    :return:
+    """
+    def decorator(fn: Renderer) -> Renderer:
+        for block_type in block_types:
+            RENDERERS[block_type] = fn
+        find_renderer.cache_clear()
+        return fn
+
+    return decorator
+
 
 @dataclass
 class NotionMarkdownExporter:
     image_dir: str
     num_index_stack: List[int] = field(default_factory=lambda: [1])
+    block_cache: Optional[BlockCache] = None
+    records: Dict[str, BlockRecord] = field(default_factory=lambda: {})
+    downloader: Optional[Downloader] = None
+    downloads: List[Tuple[int, str, 'Future[str]']] = field(default_factory=lambda: [])
+    chunks: List[str] = field(default_factory=lambda: [])
+
+    def write(self, text: str):
+        self.chunks.append(text)
 
     def export_block(self, block: Block, indent: int = 0) -> str:
         """
@@ -23,96 +53,116 @@ class NotionMarkdownExporter:
         :param indent:
         :return:
         """
-        res = '\t' * indent
-        title = self.preprocess_markdown(block.title) if hasattr(block, 'title') else ''
-
-        if isinstance(block, HeaderBlock):
-            res += f'\n# {title}'
-        elif isinstance(block, SubheaderBlock):
-            res += f'\n## {title}'
-        elif isinstance(block, SubsubheaderBlock):
-            res += f'\n### {title}'
-        elif isinstance(block, TextBlock):
-            res += title
-        elif isinstance(block, BookmarkBlock):
-            res += link_format(title, block.link)
-        elif isinstance(block, VideoBlock) or isinstance(block, FileBlock) or isinstance(block, AudioBlock) or \
-                isinstance(block, PDFBlock) or isinstance(block, GistBlock):
-            res += link_format(block.source, block.source)
-        elif isinstance(block, BulletedListBlock):
-            res += f'* {title}'
-            res += self.export_blocks(block.children, indent + 1)
-        elif isinstance(block, NumberedListBlock):
-            res += f'{self.num_index_stack[-1]}. {title}'
-            self.num_index_stack[-1] += 1
-            res += self.export_blocks(block.children, indent + 1)
-        elif isinstance(block, ImageBlock):
-            img_path = self.image_export(block.caption, block.source)
-            res += f'\n!{link_format(block.caption or img_path, img_path)}'
-        elif isinstance(block, CodeBlock):
-            res += f'\n```{block.language}\n{block.title}\n```'
-        elif isinstance(block, EquationBlock):
-            res += f'\n$$\n{block.latex}\n$$'
-        elif isinstance(block, DividerBlock):
-            res += '---'
-        elif isinstance(block, TodoBlock):
-            res += f'- [x] {title}' if block.checked else f'- [ ] {title}'
-        elif isinstance(block, QuoteBlock):
-            res += f'\n> {title}'
-
-        return res
-
-    def export_blocks(self, blocks: List[Block], indent: int = 0):
+        return self.render(self.write_block, block, indent)
+
+    def write_block(self, block: Block, indent: int = 0):
+        """
+        Writes the markdown of a block to the output chunks
+        :param block:
+        :param indent:
+        :return:
+        """
+        if self.block_cache is not None:
+            self.records[block.id] = block.get()
+
+        if indent:
+            self.write('\t' * indent)
+        renderer = find_renderer(type(block))
+        if renderer is not None:
+            renderer(self, block, indent)
+
+    def export_blocks(self, blocks: List[Block], indent: int = 0) -> str:
         """
         Renders a list of blocks to markdown
         :param blocks:
         :param indent:
         :return:
         """
+        return self.render(self.write_blocks, blocks, indent)
+
+    def write_blocks(self, blocks: List[Block], indent: int = 0):
+        """
+        Writes the markdown of a list of blocks to the output chunks
+        :param blocks:
+        :param indent:
+        :return:
+        """
         if len(blocks) == 0:
-            return ''
-        res = '' if indent == 0 else '\n'
+            return
+        if indent != 0:
+            self.write('\n')
         self.num_index_stack.append(1)
-        for block in blocks:
-            if block != blocks[0]:
-                res += '\n'
-            res += self.export_block(block, indent)
+        for i, block in enumerate(blocks):
+            if i > 0:
+                self.write('\n')
+            self.write_block(block, indent)
         self.num_index_stack.pop()
-        return res
 
-    def export_page(self, page: Block):
+    def render(self, fn: Callable, *args) -> str:
+        chunks, self.chunks = self.chunks, []
+        try:
+            fn(*args)
+            return ''.join(self.chunks)
+        finally:
+            self.chunks = chunks
+
+    def title(self, block: Block) -> str:
+        return self.preprocess_markdown(block.title) if hasattr(block, 'title') else ''
+
+    def export_page(self, page: Block) -> str:
         """
-        Renders a page to markdown
+        Renders a page to markdown. The chunks are joined once the images downloaded in the background are stored
         :param page:
         :return:
         """
         self.num_index_stack = []
-        return self.export_blocks(page.children)
+        self.downloads = []
+        self.chunks = []
+        if self.block_cache is None:
+            self.write_blocks(page.children)
+        else:
+            self.records = {}
+            self.block_cache.load(page)
+            self.write_blocks(self.children(page))
+            self.block_cache.store(page, self.records)
+
+        chunks, downloads = self.chunks, self.downloads
+        self.chunks, self.downloads = [], []
+
+        # Fill in the paths of the files downloaded in the background
+        for i, placeholder, future in downloads:
+            chunks[i] = chunks[i].replace(placeholder, future.result())
+        return ''.join(chunks)
+
+    def children(self, block: Block) -> List[Block]:
+        """
+        Returns the children of a block, served from the block cache if possible
+        :param block:
+        :return:
+        """
+        if self.block_cache is None:
+            return block.children
+        return self.block_cache.children(block)
 
     def image_export(self, caption: str, url: str):
         """
         make image file based on url and count.
         :param caption: image caption to use for filename
         :param url: url of image
-        :return: image_path for the link in markdown
+        :return: image_path for the link in markdown. If a downloader is used, this is a placeholder which is
+            replaced by the image path once the page is rendered. The placeholder must be written as the next chunk
         """
         os.makedirs(self.image_dir, exist_ok=True)
 
         caption, _ = os.path.splitext(caption)
         filename = f'{caption}-{uuid.uuid4()}'
 
-        try:
-            r = requests.get(url, allow_redirects=True)
-            content_type = r.headers['content-type']
-            image_path = os.path.abspath(
-                os.path.join(self.image_dir, f'{filename}{mimetypes.guess_extension(content_type)}')
-            )
-            with open(image_path, 'wb') as f:
-                f.write(r.content)
-        except Exception as e:
-            logging.exception(e)
-            image_path = filename
-        return image_path
+        if self.downloader is None:
+            return download(url, self.image_dir, filename)
+
+        placeholder = f'\0download:{len(self.downloads)}\0'
+        self.downloads.append((len(self.chunks), placeholder, self.downloader.submit(url, self.image_dir, filename)))
+        return placeholder
 
     def preprocess_markdown(self, text: str) -> str:
         """
@@ -133,3 +183,88 @@ def link_format(name, url):
     :return:
     """
     return f'[{name}]({url})'
+
+
+@lru_cache(maxsize=None)
+def find_renderer(block_type: Type[Block]) -> Optional[Renderer]:
+    """
+    Finds the renderer of the most specific registered base class of the block type
+    :param block_type:
+    :return:
+    """
+    return next((RENDERERS[cls] for cls in block_type.__mro__ if cls in RENDERERS), None)
+
+
+@register_renderer(HeaderBlock)
+def render_header(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    exporter.write(f'\n# {exporter.title(block)}')
+
+
+@register_renderer(SubheaderBlock)
+def render_subheader(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    exporter.write(f'\n## {exporter.title(block)}')
+
+
+@register_renderer(SubsubheaderBlock)
+def render_subsubheader(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    exporter.write(f'\n### {exporter.title(block)}')
+
+
+@register_renderer(TextBlock)
+def render_text(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    exporter.write(exporter.title(block))
+
+
+@register_renderer(BookmarkBlock)
+def render_bookmark(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    exporter.write(link_format(exporter.title(block), block.link))
+
+
+@register_renderer(VideoBlock, FileBlock, AudioBlock, PDFBlock, GistBlock)
+def render_embed(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    exporter.write(link_format(block.source, block.source))
+
+
+@register_renderer(BulletedListBlock)
+def render_bulleted_list(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    exporter.write(f'* {exporter.title(block)}')
+    exporter.write_blocks(exporter.children(block), indent + 1)
+
+
+@register_renderer(NumberedListBlock)
+def render_numbered_list(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    exporter.write(f'{exporter.num_index_stack[-1]}. {exporter.title(block)}')
+    exporter.num_index_stack[-1] += 1
+    exporter.write_blocks(exporter.children(block), indent + 1)
+
+
+@register_renderer(ImageBlock)
+def render_image(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    img_path = exporter.image_export(block.caption, block.source)
+    exporter.write(f'\n!{link_format(block.caption or img_path, img_path)}')
+
+
+@register_renderer(CodeBlock)
+def render_code(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    exporter.write(f'\n```{block.language}\n{block.title}\n```')
+
+
+@register_renderer(EquationBlock)
+def render_equation(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    exporter.write(f'\n$$\n{block.latex}\n$$')
+
+
+@register_renderer(DividerBlock)
+def render_divider(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    exporter.write('---')
+
+
+@register_renderer(TodoBlock)
+def render_todo(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    title = exporter.title(block)
+    exporter.write(f'- [x] {title}' if block.checked else f'- [ ] {title}')
+
+
+@register_renderer(QuoteBlock)
+def render_quote(exporter: NotionMarkdownExporter, block: Block, indent: int):
+    exporter.write(f'\n> {exporter.title(block)}')
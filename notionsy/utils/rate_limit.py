@@ -0,0 +1,106 @@
+__all__ = ['RateLimiter', 'is_transient', 'TRANSIENT_STATUS_CODES']
+
+import logging
+import threading
+import time
+from functools import wraps
+from typing import Callable
+
+from notion.client import NotionClient
+from requests import RequestException, HTTPError
+
+# Status codes of requests which may succeed when retried
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the rate of requests. Allows bursts of up to `burst` requests while
+    refilling at `rate` requests per second. A non positive rate disables the limiter
+    """
+    rate: float
+    burst: int
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        super().__init__()
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, tokens: int = 1):
+        """
+        Blocks until the given amount of tokens is available and consumes them
+        :param tokens:
+        :return:
+        """
+        if not self.enabled:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= tokens
+            # Tokens are reserved while holding the lock, so concurrent callers queue up fairly
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if delay > 0:
+            logging.debug(f'Rate limit reached, waiting {delay:.2f}s')
+            time.sleep(delay)
+
+    def backoff(self, seconds: float):
+        """
+        Delays all the following requests by the given amount of seconds, e.g. after a transient server error.
+        Sleeps right away if the limiter is disabled
+        :param seconds:
+        :return:
+        """
+        if not self.enabled:
+            time.sleep(seconds)
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def throttle(self, fn: Callable) -> Callable:
+        """
+        Wraps the given function so that every call acquires a token first
+        :param fn:
+        :return:
+        """
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            self.acquire()
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    def install(self, client: NotionClient) -> NotionClient:
+        """
+        Routes all the api requests of the given client through the limiter
+        :param client:
+        :return:
+        """
+        client.post = self.throttle(client.post)
+        return client
+
+
+def is_transient(error: RequestException) -> bool:
+    """
+    Whether the request may succeed when retried: connection errors, timeouts, rate limiting and server errors.
+    notion-py raises client errors without a response
+    :param error:
+    :return:
+    """
+    if isinstance(error, HTTPError):
+        return error.response is not None and error.response.status_code in TRANSIENT_STATUS_CODES
+    return True
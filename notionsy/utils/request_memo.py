@@ -0,0 +1,116 @@
+__all__ = ['RequestMemo', 'READ_ENDPOINTS']
+
+import json
+import logging
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Tuple
+
+from notion.client import NotionClient
+
+# Endpoints of notion-py which only read records
+READ_ENDPOINTS = {
+    'loadPageChunk', 'queryCollection', 'getRecordValues', 'syncRecordValues', 'loadUserContent', 'getSpaces',
+    'getPublicPageData', 'getPublicSpaceData', 'getBacklinksForBlock', 'search', 'searchPagesWithParent',
+}
+
+Key = Tuple[str, str]
+
+
+class RequestMemo:
+    """
+    Shares the responses of identical read requests of a client while sharing, so the sync roots of one process
+    fetch overlapping Notion trees once. Concurrent identical requests wait for the first one. Any other request
+    may write, so it drops all the memoized responses, including the ones of reads still in flight
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.entries: Dict[Key, Future] = {}
+        self.generation = 0
+        self.depth = 0
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    @property
+    def sharing(self) -> bool:
+        return self.depth > 0
+
+    @contextmanager
+    def share(self):
+        """
+        Memoizes the read requests within the context. The responses are dropped once the outermost context exits,
+        so later passes see the changes made in Notion meanwhile
+        :return:
+        """
+        with self.lock:
+            self.depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.entries.clear()
+                    logging.debug(f'Shared {self.hits} notion read requests')
+                    self.hits = 0
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def memoize(self, fn: Callable) -> Callable:
+        """
+        Wraps the given post function so that identical read requests are answered once while sharing
+        :param fn:
+        :return:
+        """
+        @wraps(fn)
+        def wrapper(endpoint, data):
+            if endpoint not in READ_ENDPOINTS:
+                self.invalidate()
+                return fn(endpoint, data)
+            if not self.sharing:
+                return fn(endpoint, data)
+
+            key = (endpoint, json.dumps(data, sort_keys=True, default=str))
+            with self.lock:
+                entry = self.entries.get(key)
+                owner = entry is None
+                if owner:
+                    entry = self.entries[key] = Future()
+                    generation = self.generation
+                else:
+                    self.hits += 1
+            if not owner:
+                return entry.result()
+
+            try:
+                response = fn(endpoint, data)
+            except BaseException as e:
+                with self.lock:
+                    if self.entries.get(key) is entry:
+                        del self.entries[key]
+                entry.set_exception(e)
+                raise
+            entry.set_result(response)
+            with self.lock:
+                # A write during the request may not be reflected in its response
+                if generation != self.generation and self.entries.get(key) is entry:
+                    del self.entries[key]
+            return response
+
+        return wrapper
+
+    def install(self, client: NotionClient) -> NotionClient:
+        """
+        Routes all the api requests of the given client through the memo. Should be installed after the batcher,
+        so writes invalidate the memo once they are queued rather than once they are submitted
+        :param client:
+        :return:
+        """
+        client.post = self.memoize(client.post)
+        return client
@@ -0,0 +1,96 @@
+__all__ = ['DirectoryScanner', 'is_dir']
+
+import os
+import stat as stat_module
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+Path = str
+Listing = Dict[str, os.stat_result]
+
+
+class DirectoryScanner:
+    """
+    Lists directories through os.scandir and keeps the stat results of their entries for the duration of a scan,
+    so every entry is stat'ed at most once. Directories can be listed ahead in parallel for slow file systems
+    """
+    root_dir: Path
+    ignored: Set[str]
+    workers: int
+    listings: Dict[Path, Optional[Listing]]
+
+    def __init__(self, root_dir: Path, ignored: Iterable[str] = (), workers: int = 1) -> None:
+        super().__init__()
+        self.root_dir = root_dir
+        self.ignored = set(ignored)
+        self.workers = max(1, workers)
+        self.listings = {}
+        self.root_stat: Optional[os.stat_result] = None
+
+    def stat(self, rel_path: Path) -> Optional[os.stat_result]:
+        """
+        Returns the stat result of the given path from the listing of its parent directory
+        :param rel_path: path relative to the root dir
+        :return: None if the path does not exist
+        """
+        if rel_path == '.':
+            if self.root_stat is None:
+                try:
+                    self.root_stat = os.stat(self.root_dir)
+                except OSError:
+                    return None
+            return self.root_stat
+
+        listing = self.listing(os.path.dirname(rel_path) or '.')
+        return listing.get(os.path.basename(rel_path)) if listing is not None else None
+
+    def listing(self, rel_dir: Path) -> Optional[Listing]:
+        """
+        Returns the entries of the given directory with their stat results, excluding the ignored names
+        :param rel_dir: path relative to the root dir
+        :return: None if the path is not a directory
+        """
+        if rel_dir not in self.listings:
+            self.listings[rel_dir] = self.scan(rel_dir)[1]
+        return self.listings[rel_dir]
+
+    def scan(self, rel_dir: Path) -> Tuple[Path, Optional[Listing]]:
+        listing = {}
+        try:
+            with os.scandir(os.path.join(self.root_dir, rel_dir)) as it:
+                for entry in it:
+                    if entry.name in self.ignored:
+                        continue
+                    try:
+                        listing[entry.name] = entry.stat()
+                    except OSError:
+                        # Broken symlinks do not exist, the same as for os.path.exists
+                        continue
+        except (NotADirectoryError, FileNotFoundError):
+            return rel_dir, None
+        return rel_dir, listing
+
+    def prefetch(self, affected: Optional[Set[Path]] = None):
+        """
+        Lists the directory tree ahead with a pool of workers. Does nothing without multiple workers
+        :param affected: only directories within these paths are listed, None lists everything
+        :return:
+        """
+        if self.workers <= 1:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='notionsy-scan') as executor:
+            pending = {executor.submit(self.scan, '.')}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rel_dir, listing = future.result()
+                    self.listings[rel_dir] = listing
+                    for name, stat in (listing or {}).items():
+                        sub_dir = os.path.normpath(os.path.join(rel_dir, name))
+                        if is_dir(stat) and (affected is None or sub_dir in affected):
+                            pending.add(executor.submit(self.scan, sub_dir))
+
+
+def is_dir(stat: os.stat_result) -> bool:
+    return stat_module.S_ISDIR(stat.st_mode)
@@ -1,16 +1,67 @@
-__all__ = ['SecretYamlObject']
+__all__ = ['SecretYamlObject', 'json_dumps', 'json_loads', 'atomic_open']
 
-from copy import copy
+import json
+import os
+from contextlib import contextmanager
+from typing import Any, Union
 
 import yaml
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class SecretYamlObject(yaml.YAMLObject):
+    __slots__ = ()
     hidden_fields = []
 
     @classmethod
     def to_yaml(cls, dumper, data):
-        new_data = copy(data)
+        # Slotted objects provide their state through __getstate__
+        state = data.__getstate__() if hasattr(data, '__getstate__') else None
+        state = dict(state if isinstance(state, dict) else data.__dict__)
         for item in cls.hidden_fields:
-            del new_data.__dict__[item]
-        return dumper.represent_yaml_object(cls.yaml_tag, new_data, cls, flow_style=cls.yaml_flow_style)
+            del state[item]
+        return dumper.represent_mapping(cls.yaml_tag, state, flow_style=cls.yaml_flow_style)
+
+
+def json_dumps(data: Any) -> bytes:
+    """
+    Serializes data to compact json. Uses the C accelerated orjson if it is installed
+    :param data:
+    :return:
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def json_loads(data: Union[bytes, str]) -> Any:
+    """
+    Deserializes json data. Uses the C accelerated orjson if it is installed
+    :param data:
+    :return:
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = 'w'):
+    """
+    Opens a temporary file for writing which replaces the given path once it is written without errors
+    :param path:
+    :param mode:
+    :return:
+    """
+    tmp_path = f'{path}.tmp'
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
@@ -0,0 +1,118 @@
+__all__ = ['SnapshotStore', 'SNAPSHOTS_DIRNAME']
+
+import logging
+import os
+import shutil
+import stat
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional
+
+SNAPSHOTS_DIRNAME = '.sync.snapshots'
+OBJECTS_DIRNAME = 'objects'
+SNAPSHOT_FORMAT = '%Y%m%d-%H%M%S-%f'
+
+Path = str
+
+
+class SnapshotStore:
+    """
+    Content addressed snapshots of local files. The content of every file is stored once as a read-only object,
+    snapshots mirror the paths of their files as hard links to these objects. Files which did not change since a
+    previous snapshot only cost a link. Objects no longer linked from any snapshot are removed with the snapshots
+    which exceed the retention
+    """
+    root_dir: Path
+    keep: int
+
+    def __init__(self, root_dir: Path, keep: int = 10) -> None:
+        super().__init__()
+        self.root_dir = root_dir
+        self.keep = keep
+
+    @property
+    def path(self) -> Path:
+        return os.path.join(self.root_dir, SNAPSHOTS_DIRNAME)
+
+    @property
+    def enabled(self) -> bool:
+        return self.keep > 0
+
+    def snapshots(self) -> List[Path]:
+        """
+        :return: names of the snapshots, oldest first
+        """
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if name != OBJECTS_DIRNAME)
+
+    def snapshot(self, paths: Iterable[Path], digest: Callable[[Path], str]) -> Optional[Path]:
+        """
+        Takes a snapshot of the given files. Directories are included with all their files
+        :param paths: paths relative to the root dir, which do not have to exist
+        :param digest: content digest of a file relative to the root dir
+        :return: path of the snapshot, None if none of the files exist
+        """
+        files = sorted(set(self.expand(paths)))
+        if not files:
+            return None
+
+        snapshot_dir = os.path.join(self.path, datetime.now().strftime(SNAPSHOT_FORMAT))
+        for rel_path in files:
+            target = os.path.join(snapshot_dir, rel_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            obj = self.store(rel_path, digest(rel_path))
+            try:
+                os.link(obj, target)
+            except OSError:
+                # File systems without hard links get a copy
+                shutil.copy2(obj, target)
+
+        logging.info(f'Took a snapshot of {len(files)} files at: {snapshot_dir}')
+        return snapshot_dir
+
+    def expand(self, paths: Iterable[Path]) -> Iterable[Path]:
+        for rel_path in paths:
+            full_path = os.path.join(self.root_dir, rel_path)
+            if os.path.isfile(full_path):
+                yield os.path.normpath(rel_path)
+            elif os.path.isdir(full_path):
+                for path, _, files in os.walk(full_path):
+                    for item in files:
+                        yield os.path.relpath(os.path.join(path, item), self.root_dir)
+
+    def store(self, rel_path: Path, digest: str) -> Path:
+        """
+        Stores the content of the file as an object unless an object with the same digest exists
+        :param rel_path: path relative to the root dir
+        :param digest:
+        :return: path of the object
+        """
+        obj = os.path.join(self.path, OBJECTS_DIRNAME, digest[:2], digest)
+        if not os.path.exists(obj):
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            # Objects are copies, since the synced files may be rewritten in place
+            shutil.copy2(os.path.join(self.root_dir, rel_path), f'{obj}.tmp')
+            os.chmod(f'{obj}.tmp', stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(f'{obj}.tmp', obj)
+        return obj
+
+    def collect(self):
+        """
+        Removes the snapshots exceeding the retention and the objects which are not part of any snapshot
+        :return:
+        """
+        snapshots = self.snapshots()
+        expired = snapshots[:max(0, len(snapshots) - self.keep)]
+        for name in expired:
+            logging.debug(f'Removing expired snapshot: {name}')
+            shutil.rmtree(os.path.join(self.path, name))
+        if not expired:
+            return
+
+        objects_dir = os.path.join(self.path, OBJECTS_DIRNAME)
+        for path, _, files in os.walk(objects_dir):
+            for item in files:
+                obj = os.path.join(path, item)
+                # Objects are only linked from the snapshots, a single link is the object itself
+                if os.stat(obj).st_nlink <= 1:
+                    os.remove(obj)
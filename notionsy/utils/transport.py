@@ -0,0 +1,186 @@
+__all__ = ['RecordingAdapter', 'ReplayAdapter', 'create_client', 'CASSETTE_FORMAT']
+
+import gzip
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+from typing import Dict, Deque, Optional, Tuple
+from urllib.parse import urlparse
+
+import notion.client
+from notion.client import NotionClient
+from requests import PreparedRequest, Response
+from requests.adapters import HTTPAdapter, BaseAdapter
+from requests.exceptions import ConnectionError
+from requests.structures import CaseInsensitiveDict
+
+from notionsy.utils.serialization import json_dumps, json_loads
+
+CASSETTE_FORMAT = 'notionsy-cassette'
+CASSETTE_VERSION = 1
+
+Interaction = dict
+
+
+def request_key(request: PreparedRequest) -> Tuple[str, str]:
+    """
+    Identifies a request by its endpoint and body
+    :param request:
+    :return:
+    """
+    body = request.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return urlparse(request.url).path, body.decode('utf-8')
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Transport adapter sending the requests as usual while recording every request and response to a gzip
+    compressed json lines cassette
+    """
+
+    def __init__(self, path: str, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = gzip.open(path, 'wb')
+        self.file.write(json_dumps({'format': CASSETTE_FORMAT, 'version': CASSETTE_VERSION}) + b'\n')
+        self.count = 0
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        endpoint, body = request_key(request)
+        interaction = {
+            'method': request.method,
+            'endpoint': endpoint,
+            'request': body,
+            'status': response.status_code,
+            'content_type': response.headers.get('content-type'),
+            'response': response.content.decode('utf-8', errors='replace'),
+            'elapsed': round(elapsed, 4),
+        }
+        with self.lock:
+            self.file.write(json_dumps(interaction) + b'\n')
+            # Keep the cassette readable if the sync is killed
+            self.file.flush()
+            self.count += 1
+        return response
+
+    def close(self):
+        super().close()
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+                logging.info(f'Recorded {self.count} notion requests to: {self.path}')
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Transport adapter answering requests from a recorded cassette without any network access. Requests are
+    matched by endpoint and body, falling back to the recording order per endpoint for requests containing
+    generated ids. Recorded latencies are reproduced scaled by `latency`, 0 replays without delay
+    """
+
+    def __init__(self, path: str, latency: float = 1.0) -> None:
+        super().__init__()
+        self.path = path
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.by_key: Dict[Tuple[str, str], Deque[Interaction]] = defaultdict(deque)
+        self.by_endpoint: Dict[str, Deque[Interaction]] = defaultdict(deque)
+        self.read()
+
+    def read(self):
+        with gzip.open(self.path, 'rb') as f:
+            header = json_loads(f.readline())
+            if header.get('format') != CASSETTE_FORMAT or header.get('version') != CASSETTE_VERSION:
+                raise ValueError(f'Unsupported cassette format: {header}')
+
+            count = 0
+            try:
+                for line in f:
+                    try:
+                        interaction = json_loads(line)
+                    except ValueError:
+                        logging.warning(f'Skipping corrupt cassette entry in: {self.path}')
+                        continue
+                    interaction['used'] = False
+                    self.by_key[(interaction['endpoint'], interaction['request'])].append(interaction)
+                    self.by_endpoint[interaction['endpoint']].append(interaction)
+                    count += 1
+            except EOFError:
+                # The recording was interrupted before the cassette was closed
+                logging.warning(f'Cassette ends unexpectedly: {self.path}')
+        logging.debug(f'Loaded {count} recorded notion requests from: {self.path}')
+
+    def next(self, request: PreparedRequest) -> Optional[Interaction]:
+        key = request_key(request)
+        with self.lock:
+            for queue in [self.by_key.get(key), self.by_endpoint.get(key[0])]:
+                while queue and queue[0]['used']:
+                    queue.popleft()
+                if queue:
+                    interaction = queue.popleft()
+                    interaction['used'] = True
+                    return interaction
+        return None
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        interaction = self.next(request)
+        if interaction is None:
+            raise ConnectionError(f'No recorded response left for: {request.url}', request=request)
+
+        if self.latency > 0:
+            time.sleep(interaction['elapsed'] * self.latency)
+
+        response = Response()
+        response.status_code = interaction['status']
+        response.headers = CaseInsensitiveDict({'content-type': interaction['content_type'] or 'application/json'})
+        response._content = interaction['response'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=interaction['elapsed'])
+        return response
+
+    def close(self):
+        pass
+
+
+def create_client(
+        token_v2: Optional[str], record: Optional[str] = None, replay: Optional[str] = None, latency: float = 1.0
+) -> Tuple[NotionClient, Optional[BaseAdapter]]:
+    """
+    Creates a notion client whose traffic is recorded to or replayed from a cassette. The adapter is mounted
+    before the client is constructed, so the requests of the client setup are part of the cassette too
+    :param token_v2:
+    :param record: path of the cassette to record to
+    :param replay: path of the cassette to replay from
+    :param latency: scale of the recorded latency while replaying
+    :return: the client and the mounted adapter, which should be closed after the sync
+    """
+    if record and replay:
+        raise ValueError('Can not record and replay at the same time')
+    if not record and not replay:
+        return NotionClient(token_v2=token_v2), None
+
+    adapter = RecordingAdapter(record) if record else ReplayAdapter(replay, latency)
+    original = notion.client.create_session
+
+    def create_session(*args, **kwargs):
+        session = original(*args, **kwargs)
+        session.mount('https://', adapter)
+        return session
+
+    notion.client.create_session = create_session
+    try:
+        # The token is not sent anywhere while replaying, but is required to skip the login prompt
+        return NotionClient(token_v2=token_v2 or 'replay'), adapter
+    finally:
+        notion.client.create_session = original
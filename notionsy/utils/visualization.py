@@ -21,7 +21,7 @@ local: {node.metadata_local}
 
 def draw_tree(g: Digraph, node: SyncNode):
     draw_node(g, node)
-    for child in node.children:
+    for child in node.child_nodes:
         draw_tree(g, child)
         g.edge(str(node.id), str(child.id))
 
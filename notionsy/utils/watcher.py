@@ -0,0 +1,265 @@
+__all__ = ['Watcher', 'InotifyWatcher', 'PollingWatcher', 'create_watcher', 'affected_paths']
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+             IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 1 << 16
+
+Path = str
+Snapshot = Dict[Path, Tuple[int, int]]
+
+
+class Watcher(ABC):
+    """
+    Collects the paths, relative to the root dir, which changed since the last call to `changes`
+    """
+    root_dir: Path
+    ignored: Set[str]
+
+    def __init__(self, root_dir: Path, ignored: Iterable[str] = ()) -> None:
+        super().__init__()
+        self.root_dir = os.path.abspath(root_dir)
+        self.ignored = set(ignored)
+
+    @abstractmethod
+    def wait(self, timeout: float) -> bool:
+        """
+        Blocks until changes are available or the timeout passed
+        :param timeout: in seconds
+        :return: whether changes are available
+        """
+        pass
+
+    @abstractmethod
+    def changes(self) -> Optional[Set[Path]]:
+        """
+        Returns and resets the changed paths
+        :return: the changed paths, or None if the changes were lost and the whole root dir has to be scanned
+        """
+        pass
+
+    def close(self):
+        pass
+
+    def is_ignored(self, rel_path: Path) -> bool:
+        # Temporary files of atomic writes are ignored with the files they replace
+        parts = rel_path.split(os.sep)
+        return any(part in self.ignored or part.replace('.tmp', '') in self.ignored for part in parts)
+
+
+class InotifyWatcher(Watcher):
+    """
+    Watches the root dir recursively through the linux inotify api
+    """
+
+    def __init__(self, root_dir: Path, ignored: Iterable[str] = ()) -> None:
+        super().__init__(root_dir, ignored)
+        self.libc = load_libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches: Dict[int, Path] = {}
+        self.dirty: Set[Path] = set()
+        # Nothing is known about the changes before the watches were in place
+        self.rescan = True
+        self.incomplete = False
+        self.add_tree('.', False)
+
+    def add_watch(self, rel_path: Path) -> bool:
+        path = os.path.normpath(os.path.join(self.root_dir, rel_path))
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                logging.warning('Inotify watch limit reached, raise fs.inotify.max_user_watches')
+                self.incomplete = True
+            return False
+        self.watches[wd] = os.path.normpath(rel_path)
+        return True
+
+    def add_tree(self, rel_path: Path, mark: bool = True):
+        """
+        Watches the directory and all of its sub directories
+        :param rel_path:
+        :param mark: whether to mark everything below it dirty, since it may have changed before it was watched
+        :return:
+        """
+        self.add_watch(rel_path)
+        for path, dirs, files in os.walk(os.path.join(self.root_dir, rel_path)):
+            dirs[:] = [d for d in dirs if not self.is_ignored(os.path.relpath(os.path.join(path, d), self.root_dir))]
+            for item in dirs + files:
+                item_path = os.path.relpath(os.path.join(path, item), self.root_dir)
+                if mark and not self.is_ignored(item_path):
+                    self.dirty.add(item_path)
+            for item in dirs:
+                self.add_watch(os.path.relpath(os.path.join(path, item), self.root_dir))
+
+    def wait(self, timeout: float) -> bool:
+        readable, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if readable:
+            self.read_events()
+        return bool(self.dirty) or self.rescan
+
+    def read_events(self):
+        while True:
+            try:
+                buffer = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                offset += EVENT_HEADER.size
+                name = buffer[offset:offset + length].rstrip(b'\0').decode(sys.getfilesystemencoding(), 'replace')
+                offset += length
+                self.handle_event(wd, mask, name)
+
+    def handle_event(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            logging.warning('Inotify event queue overflowed, the whole directory will be scanned')
+            self.rescan = True
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        rel_path = os.path.normpath(os.path.join(directory, name)) if name else directory
+        if self.is_ignored(rel_path):
+            return
+
+        self.dirty.add(rel_path)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self.add_tree(rel_path)
+
+    def changes(self) -> Optional[Set[Path]]:
+        self.wait(0)
+        # Changes in unwatched directories go unnoticed, so all changes are scanned for
+        changes = None if self.rescan or self.incomplete else self.dirty
+        self.dirty, self.rescan = set(), False
+        return changes
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher(Watcher):
+    """
+    Fallback watcher comparing the modification times of all the files to the previous scan
+    """
+
+    def __init__(self, root_dir: Path, ignored: Iterable[str] = (), interval: float = 5.0) -> None:
+        super().__init__(root_dir, ignored)
+        self.interval = interval
+        self.snapshot: Snapshot = {}
+        self.dirty: Optional[Set[Path]] = None
+        self.last_scan = 0.0
+        self.scan()
+        # Nothing is known about the changes before the first scan
+        self.dirty = None
+
+    def scan(self):
+        snapshot: Snapshot = {}
+        for path, dirs, files in os.walk(self.root_dir):
+            dirs[:] = [d for d in dirs if not self.is_ignored(os.path.relpath(os.path.join(path, d), self.root_dir))]
+            for item in dirs + files:
+                rel_path = os.path.relpath(os.path.join(path, item), self.root_dir)
+                if self.is_ignored(rel_path):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(path, item))
+                except OSError:
+                    continue
+                snapshot[rel_path] = (stat.st_mtime_ns, stat.st_size)
+
+        changed = {path for path, key in snapshot.items() if self.snapshot.get(path) != key}
+        changed.update(path for path in self.snapshot if path not in snapshot)
+        if self.dirty is not None:
+            self.dirty.update(changed)
+        self.snapshot = snapshot
+        self.last_scan = time.monotonic()
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + max(timeout, 0)
+        while True:
+            time.sleep(max(0.0, min(self.last_scan + self.interval, deadline) - time.monotonic()))
+            if time.monotonic() >= self.last_scan + self.interval:
+                self.scan()
+            if self.dirty is None or self.dirty or time.monotonic() >= deadline:
+                return self.dirty is None or bool(self.dirty)
+
+    def changes(self) -> Optional[Set[Path]]:
+        changes = self.dirty
+        self.dirty = set()
+        return changes
+
+
+def load_libc() -> ctypes.CDLL:
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+def create_watcher(root_dir: Path, ignored: Iterable[str] = (), poll: bool = False, interval: float = 5.0) -> Watcher:
+    """
+    Creates an inotify watcher where available, falling back to polling otherwise
+    :param root_dir:
+    :param ignored: top level names which are not watched
+    :param poll: whether to always use polling
+    :param interval: polling interval in seconds
+    :return:
+    """
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root_dir, ignored)
+        except (OSError, AttributeError) as e:
+            logging.warning(f'Inotify is not available, falling back to polling: {e}')
+    return PollingWatcher(root_dir, ignored, interval)
+
+
+def affected_paths(changes: Iterable[Path]) -> Set[Path]:
+    """
+    Expands the changed paths with all their ancestors up to the root dir '.'
+    :param changes:
+    :return:
+    """
+    affected = {'.'}
+    for path in changes:
+        while path and path not in affected:
+            affected.add(path)
+            path = os.path.dirname(path)
+    return affected
@@ -45,7 +45,7 @@ setup(
         "urllib3==1.26.2",
     ],
     include_package_data=True,
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['benchmarks', 'benchmarks.*']),
     python_requires=">=3.7",
     classifiers=[
         "Programming Language :: Python :: 3",